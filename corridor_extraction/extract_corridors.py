@@ -4,187 +4,375 @@
 # center load centers. implements per-pair 30% threshold with three priority
 # tiers based on cost above minimum.
 #
-# methodology: converts scored grid to cost raster, routes paths using
-# scikit-image route_through_array with 8-way connectivity, classifies
-# corridors into tiers (0-10%, 10-20%, 20-30% above per-source minimum).
+# methodology: converts scored grid to cost raster, routes each source to every
+# DC hub with one scikit-image MCP_Geometric multi-target search over 8-way
+# connectivity, classifies corridors into tiers (0-10%, 10-20%, 20-30% above
+# per-source minimum).
+#
+# routing: by default each source runs one MCP_Geometric search that stops once
+# every hub is settled, and all hub paths are traced from its traceback array.
+# --routing pairwise runs one route_through_array search per source-hub pair, as
+# originally; both give the same paths and costs.
+#
+# --routing hub runs one search per DC hub instead. MCP_Geometric step costs are
+# symmetric (mean of the two pixel costs times step length), so a hub's
+# accumulated cost surface holds every source->hub cost, and walking the hub's
+# traceback array from a source cell gives its path. the surfaces and tracebacks
+# are kept in outputs/hub_surfaces/ as memory-mapped .npy files and reused while
+# the cost raster and hubs are unchanged, so a new source costs only a lookup
+# and a traceback walk. costs match the other engines up to float summation
+# order; where several paths tie, the traced path may differ.
+#
+# usage:
+#   python extract_corridors.py
+#   python extract_corridors.py --routing pairwise
+#   python extract_corridors.py --routing hub
+#   python extract_corridors.py --workers 8
+#
+# --workers N routes sources on a process pool. the cost raster is placed in
+# shared memory once, and each worker returns its sources' hub costs and path
+# cells as compact int32 arrays (path lengths and flat raster indices). results
+# come back in source order, so tier accumulation is deterministic.
 #
 # inputs: scored_grid.geojson, generation sources, data centers
 # outputs: corridor_zones.geojson with cost_tier field
 
+import argparse
+import hashlib
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+from numpy.lib.format import open_memmap
 from pathlib import Path
 from sklearn.cluster import KMeans
-from skimage.graph import route_through_array
+from skimage.graph import route_through_array, MCP_Geometric
 from shapely.geometry import Point
 
+# the lattice helpers live with the grid stage that writes the descriptor
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "grid_scoring"))
+from lattice import load_lattice, index_from_xy
+
 data_dir = Path("data")
 output_dir = Path("outputs")
 
 CRS = "EPSG:5070"
 
-grid = gpd.read_file(output_dir / "scored_grid.geojson")
-data_centers = gpd.read_file(data_dir / "datacenters" / "datacenters-shp" / "datacenters-AOI.shp")
-irez_points = gpd.read_file(data_dir / "IREZ" / "IREZ-shp" / "AOI-IREZ.shp")
 
-wind = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "wind-plants.shp")
-solar = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "solar-plants.shp")
-hydro = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "hydro-plants.shp")
-biomass = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "biomass-plants.shp")
+def route_pairwise(cost_raster, start, ends):
+    """least-cost cost and path from start to each end, one route_through_array search per end."""
+    pair_costs = []
+    pair_indices = []
+    for end in ends:
+        try:
+            indices, cost = route_through_array(cost_raster, start, end, fully_connected=True)
+            pair_costs.append(cost)
+            pair_indices.append(indices)
+        except Exception:
+            pair_costs.append(np.inf)
+            pair_indices.append(None)
+    return pair_costs, pair_indices
 
-renewables = pd.concat([wind, solar, hydro, biomass], ignore_index=True)
-renewables = gpd.GeoDataFrame(renewables, geometry='geometry', crs=CRS)
-eia_proposed = renewables[renewables['PlantStatu'] == 'Proposed'].copy()
 
-# filter for utility-scale projects (>=20 MW threshold)
-major_proposed = eia_proposed[eia_proposed['Nameplate'] >= 20].copy()
+def route_multi_target(cost_raster, start, ends):
+    """least-cost cost and path from start to each end from a single search.
 
-print(f"loaded {len(grid)} grid cells")
-print(f"loaded {len(data_centers)} data centers")
-print(f"loaded {len(irez_points)} IREZ points")
-print(f"loaded {len(major_proposed)} proposed renewable plants >= 20 MW")
+    one MCP_Geometric find_costs from start runs until every end is settled, and
+    every path is traced from the same traceback array.
+    """
+    try:
+        mcp = MCP_Geometric(cost_raster, fully_connected=True)
+        cumulative, _ = mcp.find_costs([start], ends, find_all_ends=True)
+    except Exception:
+        return [np.inf] * len(ends), [None] * len(ends)
 
-# cluster data centers into 10 regional load hubs
-print("\nclustering data centers into 10 regional hubs")
-dc_coords = np.array([[geom.x, geom.y] for geom in data_centers.geometry])
-kmeans_dc = KMeans(n_clusters=10, random_state=42, n_init=10)
-dc_labels = kmeans_dc.fit_predict(dc_coords)
+    pair_costs = []
+    pair_indices = []
+    for end in ends:
+        if np.isfinite(cumulative[end]):
+            pair_costs.append(cumulative[end])
+            pair_indices.append(mcp.traceback(end))
+        else:
+            pair_costs.append(np.inf)
+            pair_indices.append(None)
+    return pair_costs, pair_indices
+
+
+def build_hub_surfaces(cost_raster, hubs, out_dir):
+    """accumulated cost and traceback rasters rooted at each hub, as memory-mapped .npy files.
+
+    surfaces already in out_dir are reused when they were built from the same cost
+    raster and hub cells. returns the open cost and traceback arrays and the
+    neighbour offsets the traceback values index into (see load_hub_surfaces).
+    """
+    key = {
+        'cost_hash': hashlib.blake2b(cost_raster.tobytes(), digest_size=16).hexdigest(),
+        'shape': list(cost_raster.shape),
+        'hubs': [[int(row), int(col)] for row, col in hubs],
+    }
+    manifest = out_dir / "hub_surfaces.json"
+    if manifest.exists() and json.loads(manifest.read_text()) == key:
+        print(f"reusing {len(hubs)} hub cost surfaces from {out_dir}")
+    else:
+        print(f"building {len(hubs)} hub cost surfaces")
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for hub_idx, hub in enumerate(hubs):
+            mcp = MCP_Geometric(cost_raster, fully_connected=True)
+            cumulative, traceback = mcp.find_costs([hub])
+            for name, values in (('cost', cumulative), ('traceback', traceback)):
+                surface = open_memmap(out_dir / f"hub_{hub_idx}_{name}.npy", mode='w+',
+                                      dtype=values.dtype, shape=values.shape)
+                surface[:] = values
+                surface.flush()
+        np.save(out_dir / "offsets.npy", np.asarray(mcp.offsets))
+        manifest.write_text(json.dumps(key))
+
+    return load_hub_surfaces(out_dir, len(hubs))
+
+
+def load_hub_surfaces(out_dir, n_hubs):
+    """open hub cost and traceback surfaces written by build_hub_surfaces."""
+    hub_costs = [np.load(out_dir / f"hub_{i}_cost.npy", mmap_mode='r') for i in range(n_hubs)]
+    hub_tracebacks = [np.load(out_dir / f"hub_{i}_traceback.npy", mmap_mode='r') for i in range(n_hubs)]
+    return hub_costs, hub_tracebacks, np.load(out_dir / "offsets.npy")
+
+
+def walk_traceback(traceback, offsets, cell):
+    """cells from cell back to the root of an MCP traceback array (-1 at the root)."""
+    path = [cell]
+    while traceback[cell] >= 0:
+        step = offsets[traceback[cell]]
+        cell = (cell[0] - int(step[0]), cell[1] - int(step[1]))
+        path.append(cell)
+    return path
+
+
+def route_from_hub_surfaces(hub_costs, hub_tracebacks, offsets, start):
+    """least-cost cost and path from start to each hub by lookup and traceback walk."""
+    pair_costs = []
+    pair_indices = []
+    for cumulative, traceback in zip(hub_costs, hub_tracebacks):
+        cost = float(cumulative[start])
+        if np.isfinite(cost):
+            pair_costs.append(cost)
+            pair_indices.append(walk_traceback(traceback, offsets, start))
+        else:
+            pair_costs.append(np.inf)
+            pair_indices.append(None)
+    return pair_costs, pair_indices
 
-dc_hubs = []
-for i in range(10):
-    cluster_coords = dc_coords[dc_labels == i]
-    centroid_x = cluster_coords[:, 0].mean()
-    centroid_y = cluster_coords[:, 1].mean()
-    dc_hubs.append(Point(centroid_x, centroid_y))
 
-print(f"created {len(dc_hubs)} DC hub centroids")
+ROUTING = {
+    'multi': route_multi_target,
+    'pairwise': route_pairwise,
+}
 
-# combine IREZ strategic zones + utility-scale proposed plants as sources
-sources = []
-source_labels = []
 
-for idx, irez in irez_points.iterrows():
-    sources.append(irez.geometry)
-    source_labels.append(f"IREZ_{idx}")
+def make_router(routing, cost_raster, hubs, hub_dir):
+    """function giving (costs, paths) from a source cell to every hub with one routing engine.
 
-for idx, plant in major_proposed.iterrows():
-    sources.append(plant.geometry)
-    source_labels.append(f"PLANT_{idx}")
+    hub routing reads surfaces already written by build_hub_surfaces.
+    """
+    if routing == 'hub':
+        hub_costs, hub_tracebacks, offsets = load_hub_surfaces(hub_dir, len(hubs))
+        return lambda start: route_from_hub_surfaces(hub_costs, hub_tracebacks, offsets, start)
+    route = ROUTING[routing]
+    return lambda start: route(cost_raster, start, hubs)
 
-print(f"\ntotal sources: {len(sources)} ({len(irez_points)} IREZ + {len(major_proposed)} plants)")
 
-grid['centroid'] = grid.geometry.centroid
+def pack_paths(pair_costs, pair_indices, n_cols):
+    """one source's hub costs, with its paths as int32 lengths and concatenated flat raster indices."""
+    lengths = np.array([0 if indices is None else len(indices) for indices in pair_indices], dtype=np.int32)
+    paths = [np.asarray(indices, dtype=np.int32).reshape(-1, 2) for indices in pair_indices if indices is not None]
+    cells = np.concatenate(paths) if paths else np.zeros((0, 2), dtype=np.int32)
+    return np.asarray(pair_costs, dtype=np.float64), lengths, cells[:, 0] * np.int32(n_cols) + cells[:, 1]
 
-# convert scored grid to cost raster
-print("\ncreating cost surface raster")
-grid_size = 2000
-minx, miny, maxx, maxy = grid.total_bounds
 
-n_cols = int((maxx - minx) / grid_size) + 1
-n_rows = int((maxy - miny) / grid_size) + 1
+# per-process routing state for the worker pool
+_worker = {}
 
-cost_raster = np.full((n_rows, n_cols), np.inf)
-cell_to_raster = {}
 
-for idx, row in grid.iterrows():
-    cell_geom = row.geometry.centroid
-    col = int((cell_geom.x - minx) / grid_size)
-    row_idx = n_rows - 1 - int((cell_geom.y - miny) / grid_size)
+def _init_worker(shm_name, shape, routing, hubs, hub_dir):
+    """process pool initializer: attach the shared cost raster and set up the router."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    cost_raster = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker['shm'] = shm
+    _worker['n_cols'] = shape[1]
+    _worker['route'] = make_router(routing, cost_raster, hubs, hub_dir)
 
-    if 0 <= row_idx < n_rows and 0 <= col < n_cols:
-        cost_raster[row_idx, col] = row['final_score']
-        cell_to_raster[(row_idx, col)] = row['cell_id']
 
-print(f"cost raster shape: {cost_raster.shape}")
-print(f"valid cells (not inf): {np.sum(cost_raster != np.inf)}")
+def _route_task(start):
+    """process pool entry point: route one source and return compact path arrays."""
+    return pack_paths(*_worker['route'](start), _worker['n_cols'])
 
 
-def coords_to_indices(x, y, minx, miny, grid_size, n_rows, n_cols):
-    """convert geographic coordinates to raster array indices."""
-    col = int((x - minx) / grid_size)
-    row = n_rows - 1 - int((y - miny) / grid_size)
-    row = max(0, min(row, n_rows - 1))
-    col = max(0, min(col, n_cols - 1))
-    return row, col
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract tiered transmission corridors by least-cost routing')
+    parser.add_argument('--routing', choices=['multi', 'pairwise', 'hub'], default='multi',
+                        help='One search per source to all hubs, one per source-hub pair, '
+                             'or one per hub with persisted cost surfaces (default multi)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Route sources on a process pool of this many workers (default 1)')
+    args = parser.parse_args()
 
+    grid = gpd.read_file(output_dir / "scored_grid.geojson")
+    data_centers = gpd.read_file(data_dir / "datacenters" / "datacenters-shp" / "datacenters-AOI.shp")
+    irez_points = gpd.read_file(data_dir / "IREZ" / "IREZ-shp" / "AOI-IREZ.shp")
 
-print("\ncalculating least-cost paths with tiered thresholds (10%, 20%, 30%)")
+    wind = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "wind-plants.shp")
+    solar = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "solar-plants.shp")
+    hydro = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "hydro-plants.shp")
+    biomass = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "biomass-plants.shp")
 
-tier1_cells = set()
-tier2_cells = set()
-tier3_cells = set()
+    renewables = pd.concat([wind, solar, hydro, biomass], ignore_index=True)
+    renewables = gpd.GeoDataFrame(renewables, geometry='geometry', crs=CRS)
+    eia_proposed = renewables[renewables['PlantStatu'] == 'Proposed'].copy()
 
-for src_idx, (source, src_label) in enumerate(zip(sources, source_labels)):
-    src_x, src_y = source.x, source.y
-    start_row, start_col = coords_to_indices(src_x, src_y, minx, miny, grid_size, n_rows, n_cols)
+    # filter for utility-scale projects (>=20 MW threshold)
+    major_proposed = eia_proposed[eia_proposed['Nameplate'] >= 20].copy()
 
-    pair_costs = []
-    pair_indices = []
+    print(f"loaded {len(grid)} grid cells")
+    print(f"loaded {len(data_centers)} data centers")
+    print(f"loaded {len(irez_points)} IREZ points")
+    print(f"loaded {len(major_proposed)} proposed renewable plants >= 20 MW")
 
-    for hub_idx, hub in enumerate(dc_hubs):
-        hub_x, hub_y = hub.x, hub.y
-        end_row, end_col = coords_to_indices(hub_x, hub_y, minx, miny, grid_size, n_rows, n_cols)
+    # cluster data centers into 10 regional load hubs
+    print("\nclustering data centers into 10 regional hubs")
+    dc_coords = np.array([[geom.x, geom.y] for geom in data_centers.geometry])
+    kmeans_dc = KMeans(n_clusters=10, random_state=42, n_init=10)
+    dc_labels = kmeans_dc.fit_predict(dc_coords)
 
-        try:
-            indices, cost = route_through_array(
-                cost_raster,
-                (start_row, start_col),
-                (end_row, end_col),
-                fully_connected=True
-            )
-            pair_costs.append(cost)
-            pair_indices.append(indices)
-        except Exception:
-            pair_costs.append(np.inf)
-            pair_indices.append(None)
+    dc_hubs = []
+    for i in range(10):
+        cluster_coords = dc_coords[dc_labels == i]
+        centroid_x = cluster_coords[:, 0].mean()
+        centroid_y = cluster_coords[:, 1].mean()
+        dc_hubs.append(Point(centroid_x, centroid_y))
 
-    valid_costs = [c for c in pair_costs if c != np.inf]
-    if len(valid_costs) > 0:
-        min_cost = min(valid_costs)
-
-        threshold_10 = min_cost * 1.10
-        threshold_20 = min_cost * 1.20
-        threshold_30 = min_cost * 1.30
-
-        for cost, indices in zip(pair_costs, pair_indices):
-            if indices is not None:
-                for row_idx, col_idx in indices:
-                    if (row_idx, col_idx) in cell_to_raster:
-                        cell_id = cell_to_raster[(row_idx, col_idx)]
-
-                        if cost <= threshold_10:
-                            tier1_cells.add(cell_id)
-                        elif cost <= threshold_20:
-                            tier2_cells.add(cell_id)
-                        elif cost <= threshold_30:
-                            tier3_cells.add(cell_id)
-
-        print(f"{src_label}: min={min_cost:.2f}, "
-              f"T1={sum(1 for c in pair_costs if c <= threshold_10)}, "
-              f"T2={sum(1 for c in pair_costs if threshold_10 < c <= threshold_20)}, "
-              f"T3={sum(1 for c in pair_costs if threshold_20 < c <= threshold_30)}")
-
-print(f"\ntier 1 cells (0-10%): {len(tier1_cells)}")
-print(f"tier 2 cells (10-20%): {len(tier2_cells)}")
-print(f"tier 3 cells (20-30%): {len(tier3_cells)}")
-
-all_corridor_cells = tier1_cells | tier2_cells | tier3_cells
-corridors = grid[grid['cell_id'].isin(all_corridor_cells)].copy()
-
-
-def assign_tier(cell_id):
-    """assign cost tier based on cell membership (best tier wins)."""
-    if cell_id in tier1_cells:
-        return "Tier_1"
-    elif cell_id in tier2_cells:
-        return "Tier_2"
-    else:
-        return "Tier_3"
+    print(f"created {len(dc_hubs)} DC hub centroids")
+
+    # combine IREZ strategic zones + utility-scale proposed plants as sources
+    sources = []
+    source_labels = []
 
+    for idx, irez in irez_points.iterrows():
+        sources.append(irez.geometry)
+        source_labels.append(f"IREZ_{idx}")
 
-corridors['cost_tier'] = corridors['cell_id'].apply(assign_tier)
-corridors = corridors.drop(columns=['centroid'])
+    for idx, plant in major_proposed.iterrows():
+        sources.append(plant.geometry)
+        source_labels.append(f"PLANT_{idx}")
+
+    print(f"\ntotal sources: {len(sources)} ({len(irez_points)} IREZ + {len(major_proposed)} plants)")
 
-corridors.to_file(output_dir / "corridor_zones.geojson", driver='GeoJSON')
-print("corridors saved")
+    # convert scored grid to cost raster on the lattice create_grid.py built it on
+    print("\ncreating cost surface raster")
+    descriptor, _ = load_lattice(output_dir / "grid_2km_lattice.npz")
+    n_rows, n_cols = descriptor['n_rows'], descriptor['n_cols']
+
+    if not {'row', 'col'} <= set(grid.columns):
+        raise ValueError("scored_grid.geojson has no row/col lattice indices; "
+                         "rebuild the grid with create_grid.py and rescore it with score_grid.py")
+
+    # row/col are the lattice indices written by create_grid.py, in this raster's
+    # layout (north-up, origin at the AOI lower-left corner)
+    cell_rows = grid['row'].to_numpy()
+    cell_cols = grid['col'].to_numpy()
+
+    cost_raster = np.full((n_rows, n_cols), np.inf)
+    cost_raster[cell_rows, cell_cols] = grid['final_score'].to_numpy()
+
+    # cell_id of the grid cell at each raster pixel, -1 where there is no cell
+    cell_id_raster = np.full((n_rows, n_cols), -1, dtype=np.int32)
+    cell_id_raster[cell_rows, cell_cols] = grid['cell_id'].to_numpy()
+
+    print(f"cost raster shape: {cost_raster.shape}")
+    print(f"valid cells (not inf): {np.sum(cost_raster != np.inf)}")
+
+    print("\ncalculating least-cost paths with tiered thresholds (10%, 20%, 30%)")
+
+    tier1_cells = set()
+    tier2_cells = set()
+    tier3_cells = set()
+
+    hub_rows, hub_cols = index_from_xy(descriptor, [hub.x for hub in dc_hubs], [hub.y for hub in dc_hubs])
+    hub_cells = list(zip(hub_rows.tolist(), hub_cols.tolist()))
+    start_rows, start_cols = index_from_xy(descriptor, [source.x for source in sources], [source.y for source in sources])
+    starts = list(zip(start_rows.tolist(), start_cols.tolist()))
+    hub_dir = output_dir / "hub_surfaces"
+
+    routing_start = time.perf_counter()
+    if args.routing == 'hub':
+        build_hub_surfaces(cost_raster, hub_cells, hub_dir)
+
+    if args.workers > 1:
+        # workers attach to one shared copy of the cost raster; pool.map returns
+        # results in source order, so tiers accumulate the same way every run
+        shm = shared_memory.SharedMemory(create=True, size=cost_raster.nbytes)
+        shared = np.ndarray(cost_raster.shape, dtype=np.float64, buffer=shm.buf)
+        shared[:] = cost_raster
+        try:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                     initargs=(shm.name, cost_raster.shape, args.routing, hub_cells, hub_dir)) as pool:
+                routes = list(pool.map(_route_task, starts, chunksize=max(1, len(starts) // (4 * args.workers))))
+        finally:
+            del shared
+            shm.close()
+            shm.unlink()
+    else:
+        route = make_router(args.routing, cost_raster, hub_cells, hub_dir)
+        routes = [pack_paths(*route(start), n_cols) for start in starts]
+
+    flat_cell_ids = cell_id_raster.ravel()
+
+    for src_label, (pair_costs, path_lengths, path_cells_flat) in zip(source_labels, routes):
+        pair_indices = np.split(path_cells_flat, np.cumsum(path_lengths)[:-1])
+
+        valid_costs = [c for c in pair_costs if c != np.inf]
+        if len(valid_costs) > 0:
+            min_cost = min(valid_costs)
+
+            threshold_10 = min_cost * 1.10
+            threshold_20 = min_cost * 1.20
+            threshold_30 = min_cost * 1.30
+
+            for cost, indices in zip(pair_costs, pair_indices):
+                if len(indices):
+                    path_cells = flat_cell_ids[indices]
+                    path_cells = path_cells[path_cells >= 0].tolist()
+
+                    if cost <= threshold_10:
+                        tier1_cells.update(path_cells)
+                    elif cost <= threshold_20:
+                        tier2_cells.update(path_cells)
+                    elif cost <= threshold_30:
+                        tier3_cells.update(path_cells)
+
+            print(f"{src_label}: min={min_cost:.2f}, "
+                  f"T1={sum(1 for c in pair_costs if c <= threshold_10)}, "
+                  f"T2={sum(1 for c in pair_costs if threshold_10 < c <= threshold_20)}, "
+                  f"T3={sum(1 for c in pair_costs if threshold_20 < c <= threshold_30)}")
+
+    print(f"\nrouted {len(sources)} sources to {len(hub_cells)} hubs ({args.routing}, {args.workers} workers) "
+          f"in {time.perf_counter() - routing_start:.2f}s")
+
+    print(f"\ntier 1 cells (0-10%): {len(tier1_cells)}")
+    print(f"tier 2 cells (10-20%): {len(tier2_cells)}")
+    print(f"tier 3 cells (20-30%): {len(tier3_cells)}")
+
+    all_corridor_cells = tier1_cells | tier2_cells | tier3_cells
+    corridors = grid[grid['cell_id'].isin(all_corridor_cells)].copy()
+
+    # assign cost tier based on cell membership (best tier wins)
+    corridors['cost_tier'] = np.select(
+        [corridors['cell_id'].isin(tier1_cells), corridors['cell_id'].isin(tier2_cells)],
+        ["Tier_1", "Tier_2"],
+        default="Tier_3",
+    )
+
+    corridors.to_file(output_dir / "corridor_zones.geojson", driver='GeoJSON')
+    print("corridors saved")
@@ -0,0 +1,219 @@
+# capacity.py
+# inverse-distance-weighted (IDW) renewable capacity accessibility for
+# score_grid.py. each cell's value is sum(capacity / distance) over the plants,
+# with a zero distance counted as 1 m. the exact engine sums over every plant;
+# the truncated engine sums plants within a radius exactly and replaces the rest
+# with a centroid expansion of binned plants. the FFT engine treats IDW as a
+# convolution of a capacity raster with a 1/r kernel, so its cost depends on the
+# raster size rather than the plant count.
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy.signal import fftconvolve
+from scipy.spatial import cKDTree
+
+from lattice import make_descriptor, index_from_xy
+
+# float64 cell x plant arrays alive at once while a block is evaluated
+BLOCK_TEMPORARIES = 4
+
+
+def idw_block_size(n_plants, memory_mb):
+    """number of cells per block so one block's distance matrix fits the memory budget."""
+    bytes_per_cell = max(n_plants, 1) * 8 * BLOCK_TEMPORARIES
+    return max(1, int(memory_mb * 2 ** 20 // bytes_per_cell))
+
+
+def _idw_block(x, y, plant_x, plant_y, capacity):
+    """IDW capacity for one block of cells against every plant."""
+    dx = x[:, None] - plant_x[None, :]
+    dy = y[:, None] - plant_y[None, :]
+    dist = np.sqrt(dx * dx + dy * dy)
+    dist[dist == 0] = 1
+    weighted = capacity[None, :] * (1 / dist)
+    # NaN terms (missing capacity or location) are skipped, as pandas .sum() does
+    return np.nansum(weighted, axis=1)
+
+
+def idw_capacity(x, y, plant_x, plant_y, capacity, memory_mb=256, workers=1):
+    """vectorized IDW capacity at each (x, y), evaluated in memory-bounded blocks.
+
+    the cell x plant distance matrix is built block by block with at most
+    memory_mb of temporaries per block; with workers > 1 blocks run on a thread
+    pool (NumPy releases the GIL inside the array operations).
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    plant_x, plant_y = np.asarray(plant_x, dtype=float), np.asarray(plant_y, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+
+    block_size = idw_block_size(len(plant_x), memory_mb / max(workers, 1))
+    blocks = [slice(start, start + block_size) for start in range(0, len(x), block_size)]
+
+    def run(block):
+        return _idw_block(x[block], y[block], plant_x, plant_y, capacity)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run, blocks))
+    else:
+        results = [run(block) for block in blocks]
+
+    return np.concatenate(results) if results else np.zeros(0)
+
+
+def _box_distance(x, y, box_minx, box_miny, size):
+    """distance from points to axis-aligned square boxes (0 inside a box)."""
+    dx = np.maximum(np.maximum(box_minx - x, x - (box_minx + size)), 0)
+    dy = np.maximum(np.maximum(box_miny - y, y - (box_miny + size)), 0)
+    return np.hypot(dx, dy)
+
+
+def idw_capacity_truncated(x, y, plant_x, plant_y, capacity, groups, radius=50000, bin_size=None, memory_mb=256):
+    """IDW capacity, in total and per plant group, with an exact near field and a binned far field.
+
+    plants are assigned to square bin_size bins (default radius / 4). for each
+    cell, plants in bins that come within radius of it are summed exactly; every
+    other bin is expanded about its capacity-weighted centroid c: each plant p
+    contributes 1/|r - c| + (p - c).(r - c)/|r - c|^3, so the far field of all
+    groups is one cell x bin distance matrix and three matrix products against
+    per-bin capacity moments. the dropped terms are of order
+    (bin_size / radius) ** 2 relative to a far bin's contribution. near pairs come
+    from a KD-tree distance query between cells and plants, and cells are
+    processed in batches whose pairs and far-field matrices fit in memory_mb.
+    groups maps a name to a boolean mask over the plants; returns a dict of
+    per-cell arrays ('total' plus one per group).
+    """
+    bin_size = bin_size or radius / 4
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    plant_x, plant_y = np.asarray(plant_x, dtype=float), np.asarray(plant_y, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+
+    # plants without a location or capacity add nothing, as in the exact sum
+    valid = np.isfinite(plant_x) & np.isfinite(plant_y) & np.isfinite(capacity)
+    plant_x, plant_y, capacity = plant_x[valid], plant_y[valid], capacity[valid]
+    names = ['total'] + list(groups)
+    values = np.column_stack([capacity] + [np.where(np.asarray(groups[name])[valid], capacity, 0.0)
+                                           for name in groups])
+
+    results = np.zeros((len(x), len(names)))
+    if len(capacity) == 0 or len(x) == 0:
+        return {name: results[:, k] for k, name in enumerate(names)}
+
+    # per-bin capacity, centroid and first moments about the centroid for every group
+    origin_x, origin_y = plant_x.min(), plant_y.min()
+    plant_bin_x = np.floor((plant_x - origin_x) / bin_size).astype(np.int64)
+    plant_bin_y = np.floor((plant_y - origin_y) / bin_size).astype(np.int64)
+    bins, plant_bin = np.unique(np.column_stack([plant_bin_x, plant_bin_y]), axis=0, return_inverse=True)
+    plant_bin = plant_bin.ravel()
+    bin_minx = origin_x + bins[:, 0] * bin_size
+    bin_miny = origin_y + bins[:, 1] * bin_size
+
+    bin_capacity = np.bincount(plant_bin, weights=capacity, minlength=len(bins))
+    # a bin whose plants all have zero capacity adds nothing and has no
+    # capacity-weighted centroid, so it is left out of the far field
+    active = bin_capacity > 0
+    centroid_x = np.divide(np.bincount(plant_bin, weights=capacity * plant_x, minlength=len(bins)), bin_capacity,
+                           out=np.zeros(len(bins)), where=active)
+    centroid_y = np.divide(np.bincount(plant_bin, weights=capacity * plant_y, minlength=len(bins)), bin_capacity,
+                           out=np.zeros(len(bins)), where=active)
+    offset_x = plant_x - centroid_x[plant_bin]
+    offset_y = plant_y - centroid_y[plant_bin]
+    moment_0 = np.zeros((len(bins), len(names)))
+    moment_x = np.zeros((len(bins), len(names)))
+    moment_y = np.zeros((len(bins), len(names)))
+    np.add.at(moment_0, plant_bin, values)
+    np.add.at(moment_x, plant_bin, values * offset_x[:, None])
+    np.add.at(moment_y, plant_bin, values * offset_y[:, None])
+    far_minx, far_miny = bin_minx[active], bin_miny[active]
+    far_cx, far_cy = centroid_x[active], centroid_y[active]
+    moment_0, moment_x, moment_y = moment_0[active], moment_x[active], moment_y[active]
+
+    # a plant in a bin within radius of a cell is at most radius + the bin diagonal away
+    search_radius = radius + bin_size * np.sqrt(2)
+    plant_tree = cKDTree(np.column_stack([plant_x, plant_y]))
+
+    # expected near pairs per cell from the plant density over the cells' extent
+    extent = max((x.max() - x.min() + 2 * search_radius) * (y.max() - y.min() + 2 * search_radius), 1)
+    pairs_per_cell = min(len(capacity), len(capacity) * np.pi * search_radius ** 2 / extent)
+    bytes_per_cell = (pairs_per_cell * (len(names) + 6) + len(far_cx) * BLOCK_TEMPORARIES * 2) * 8
+    batch = max(1, int(memory_mb * 2 ** 20 // bytes_per_cell))
+
+    for start in range(0, len(x), batch):
+        bx, by = x[start:start + batch], y[start:start + batch]
+
+        # near field: exact sum over plants in bins within radius
+        pairs = cKDTree(np.column_stack([bx, by])).sparse_distance_matrix(
+            plant_tree, search_radius, output_type='ndarray'
+        )
+        cell, plant, dist = pairs['i'], pairs['j'], pairs['v']
+        bin_of_pair = plant_bin[plant]
+        near = _box_distance(bx[cell], by[cell], bin_minx[bin_of_pair], bin_miny[bin_of_pair], bin_size) < radius
+        cell, plant, dist = cell[near], plant[near], dist[near]
+        dist[dist == 0] = 1
+        near_sum = np.zeros((len(bx), len(names)))
+        np.add.at(near_sum, cell, values[plant] / dist[:, None])
+
+        # far field: centroid expansion of every bin that stays at least radius away
+        far = _box_distance(bx[:, None], by[:, None], far_minx[None, :], far_miny[None, :], bin_size) >= radius
+        dx = bx[:, None] - far_cx[None, :]
+        dy = by[:, None] - far_cy[None, :]
+        inverse = np.where(far, 1 / np.hypot(dx, dy), 0)
+        inverse_cubed = inverse ** 3
+        far_sum = inverse @ moment_0 + (inverse_cubed * dx) @ moment_x + (inverse_cubed * dy) @ moment_y
+
+        results[start:start + batch] = near_sum + far_sum
+
+    return {name: results[:, k] for k, name in enumerate(names)}
+
+
+def inverse_distance_kernel(half_rows, half_cols, pixel_size):
+    """1/r kernel on pixel offsets, with the center pixel set to the mean of 1/r over a pixel."""
+    dy = np.arange(-half_rows, half_rows + 1)[:, None] * pixel_size
+    dx = np.arange(-half_cols, half_cols + 1)[None, :] * pixel_size
+    r = np.hypot(dx, dy)
+    r[half_rows, half_cols] = 1
+    kernel = 1 / r
+    # mean of 1/r over a square pixel of side a centered on the plant is 4 ln(1 + sqrt 2) / a
+    kernel[half_rows, half_cols] = 4 * np.log(1 + np.sqrt(2)) / pixel_size
+    return kernel
+
+
+def capacity_surface(plant_x, plant_y, capacity, bounds, pixel_size, out_dir, crs):
+    """IDW capacity at every pixel by FFT convolution, written as a memory-mapped .npy file.
+
+    capacity is summed onto a north-up pixel_size raster covering bounds and every
+    plant, then convolved with a 1/r kernel spanning the whole raster, so each pixel
+    gets sum(capacity / distance) over all plants in O(N log N). the surface
+    (capacity_surface.npy, described by capacity_lattice.json) can be sampled with
+    proximity.sample_surface. returns the descriptor and the open surface.
+    """
+    plant_x, plant_y = np.asarray(plant_x, dtype=float), np.asarray(plant_y, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+    valid = np.isfinite(plant_x) & np.isfinite(plant_y) & np.isfinite(capacity)
+    plant_x, plant_y, capacity = plant_x[valid], plant_y[valid], capacity[valid]
+
+    minx, miny, maxx, maxy = bounds
+    if len(capacity):
+        minx, miny = min(minx, plant_x.min()), min(miny, plant_y.min())
+        maxx, maxy = max(maxx, plant_x.max()), max(maxy, plant_y.max())
+    descriptor = make_descriptor(minx, miny, maxx, maxy, pixel_size, crs)
+    shape = (descriptor['n_rows'], descriptor['n_cols'])
+
+    plants = np.zeros(shape)
+    row, col = index_from_xy(descriptor, plant_x, plant_y)
+    np.add.at(plants, (row, col), capacity)
+
+    kernel = inverse_distance_kernel(shape[0] - 1, shape[1] - 1, pixel_size)
+    values = fftconvolve(plants, kernel, mode='valid')
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / "capacity_lattice.json", 'w') as f:
+        json.dump(descriptor, f, indent=2)
+    surface = open_memmap(out_dir / "capacity_surface.npy", mode='w+', dtype=np.float32, shape=shape)
+    # FFT round-off can leave tiny negatives where there is no capacity nearby
+    surface[:] = np.clip(values, 0, None)
+    surface.flush()
+
+    return descriptor, surface
@@ -1,96 +1,776 @@
 # create_grid.py
 # generates 2km grid cells across study area and calculates percentage overlap
-# with protected lands (GAP 1-2) and military installations.
+# with each registered constraint layer (protected lands (GAP 1-2) and military
+# installations by default, see CONSTRAINT_LAYERS).
 #
-# inputs: study area boundary, protected areas (GAP 1-2), military installations
-# outputs: 2km grid with protected_pct and military_pct fields
+# usage:
+#   python create_grid.py
+#   python create_grid.py --grid-size 500
+#   python create_grid.py --benchmark 2000 500 250
+#   python create_grid.py --compare-overlap
+#   python create_grid.py --overlap-method raster --subcell-size 100 --compare-overlap
+#   python create_grid.py --workers 32
+#   python create_grid.py --scaling 1 2 4 8 16 32
+#   python create_grid.py --incremental
+#   python create_grid.py --adaptive --coarse-size 8000 --min-size 500
+#   python create_grid.py --grid-size 500 --compact
+#   python create_grid.py --prepare-constraints
+#
+# inputs: study area boundary, constraint layers in CONSTRAINT_LAYERS
+# constraint layers are repaired, clipped to the AOI and dissolved once, then cached
+# in outputs/cache as FlatGeobuf keyed by source-file hash, so overlapping
+# polygons (common in PAD-US) are not double counted. --raw-constraints uses the
+# original per-feature layers instead.
+#
+# outputs: 2km grid with row/col lattice indices, cx/cy centroids and a {prefix}_pct field per
+#          constraint layer, the lattice descriptor and AOI validity mask
+#          (grid_2km_lattice.npz), and a per-feature fingerprint of the inputs for
+#          --incremental updates. --compact stores the cell table without geometry
+#          (grid_2km_cells.npz) instead of GeoJSON and removes a GeoJSON left by an
+#          earlier run (and vice versa); --incremental patches the format it is given. --adaptive writes
+#          grid_adaptive.geojson with quadkey/level/cell_size
 
+import argparse
+import multiprocessing as mp
+import re
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
 import geopandas as gpd
-from shapely.geometry import box
+import shapely
 from pathlib import Path
 
+from lattice import (make_descriptor, cell_index, validity_mask, save_lattice, load_lattice,
+                     save_cells, load_cells, load_cells_meta, materialize, polygon_parts, clip_to_regions)
+from fingerprint import file_hash, layer_fingerprint, changed_bounds, save_fingerprint, load_fingerprint
+from rasterize import rasterize_polygons, block_sum
+
 data_dir = Path("data")
 output_dir = Path("outputs")
-output_dir.mkdir(exist_ok=True)
+aoi_path = data_dir / "states" / "states-of-interest" / "AOI.shp"
+cache_dir = output_dir / "cache"
 
 CRS = "EPSG:5070"
 
-states = gpd.read_file(data_dir / "states" / "states-of-interest" / "AOI.shp")
-protected_lands = gpd.read_file(data_dir / "protected-areas" / "gap1and2PAD" / "gap1-2PAD.shp")
-if protected_lands.crs != CRS:
-    protected_lands = protected_lands.to_crs(CRS)
+# constraint layers scored as penalties. each entry adds a {prefix}_pct coverage
+# column to the grid and score_grid.py applies a matching penalty_{prefix}.
+# new layers (wetlands, tribal lands, critical habitat, urban cores) only need
+# an entry here; all layers share one spatial index pass.
+CONSTRAINT_LAYERS = [
+    {'name': 'protected lands (GAP 1-2)',
+     'path': Path("protected-areas") / "gap1and2PAD" / "gap1-2PAD.shp",
+     'prefix': 'protected'},
+    {'name': 'military installations',
+     'path': Path("military") / "military_areas" / "military-areas.shp",
+     'prefix': 'military'},
+]
+
+# existing right-of-way layers; dense ROW triggers quadtree refinement in --adaptive mode
+ROW_LAYERS = [
+    Path("transmission-lines") / "aoi-transmission-lines-shp" / "AOI-transmission-lines-138kv.shp",
+    Path("roads") / "roads-of-interest" / "roads-AOI.shp",
+    Path("rails") / "rails-of-interest" / "rails-AOI.shp",
+    Path("pipelines") / "natural_gas" / "naturalgas-pipelines.shp",
+    Path("pipelines") / "hydrocarbon_pipelines" / "hydrocarbon-pipelines.shp",
+]
+
+# coverage strictly between these bounds counts as mixed for quadtree splitting
+MIXED_PCT_RANGE = (1e-6, 100 - 1e-6)
+
+
+def grid_name(grid_size):
+    """output layer name for a grid resolution (grid_2km, grid_500m, ...)."""
+    if grid_size % 1000 == 0:
+        return f"grid_{grid_size // 1000}km"
+    return f"grid_{grid_size}m"
+
+
+def load_study_area():
+    """load the study area boundary."""
+    return gpd.read_file(aoi_path)
+
+
+def load_raw_constraint(layer):
+    """load one registered constraint layer in the project CRS, repaired."""
+    gdf = gpd.read_file(data_dir / layer['path'])
+    if gdf.crs != CRS:
+        gdf = gdf.to_crs(CRS)
+    gdf['geometry'] = gdf.geometry.buffer(0)
+    return gdf
+
+
+def prepare_constraint(layer, states):
+    """repaired, AOI-clipped and dissolved constraint layer, cached by source-file hash."""
+    key = f"{file_hash(data_dir / layer['path'])[:16]}_{file_hash(aoi_path)[:16]}"
+    cache_path = cache_dir / f"{layer['prefix']}_{key}.fgb"
+    if cache_path.exists():
+        return gpd.read_file(cache_path)
+
+    print(f"preparing {layer['name']}: repair, clip to AOI, dissolve")
+    gdf = load_raw_constraint(layer)
+    aoi = shapely.union_all(states.geometry.values)
+    shapely.prepare(aoi)
+
+    # clipping to the AOI leaves cell overlap unchanged since every cell lies inside it
+    geoms = gdf.geometry.values[shapely.intersects(aoi, gdf.geometry.values)]
+    clipped = shapely.intersection(geoms, aoi)
+    parts = shapely.get_parts(shapely.union_all(clipped))
+    parts = parts[shapely.get_type_id(parts) == 3]
+    prepared = gpd.GeoDataFrame(geometry=parts, crs=CRS)
+    print(f"  {len(gdf)} features -> {len(prepared)} non-overlapping polygons")
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # match the whole {prefix}_{source}_{aoi}.fgb name, so a prefix that starts another
+    # layer's prefix does not remove that layer's cache
+    stale_name = re.compile(rf"{re.escape(layer['prefix'])}_[0-9a-f]{{16}}_[0-9a-f]{{16}}\.fgb")
+    for stale in cache_dir.glob("*.fgb"):
+        if stale_name.fullmatch(stale.name):
+            stale.unlink()
+    prepared.to_file(cache_path, driver='FlatGeobuf')
+    return prepared
+
+
+def load_constraints(dissolve=True, states=None):
+    """load every registered constraint layer keyed by pct column.
+
+    by default layers come from the dissolved, AOI-clipped cache; with
+    dissolve=False the original features are loaded and only repaired.
+    """
+    if dissolve and states is None:
+        states = load_study_area()
+
+    constraints = {}
+    for layer in CONSTRAINT_LAYERS:
+        if dissolve:
+            constraints[f"{layer['prefix']}_pct"] = prepare_constraint(layer, states)
+        else:
+            constraints[f"{layer['prefix']}_pct"] = load_raw_constraint(layer)
+    return constraints
+
+
+def load_row_lines():
+    """load all right-of-way line layers as one GeoSeries in the project CRS."""
+    return gpd.GeoSeries(
+        pd.concat([gpd.read_file(data_dir / path).to_crs(CRS).geometry for path in ROW_LAYERS],
+                  ignore_index=True),
+        crs=CRS,
+    )
+
+
+def lattice_shape(minx, miny, maxx, maxy, grid_size):
+    """number of lattice cells along x and y covering a bounding box."""
+    n_cells_x = int((maxx - minx) / grid_size) + 1
+    n_cells_y = int((maxy - miny) / grid_size) + 1
+    return n_cells_x, n_cells_y
+
+
+def build_cells(origin, grid_size, n_cells_y, i_index, j_index):
+    """build the lattice cells for a block of x (i) and y (j) indices in one call."""
+    # x-major ordering keeps cell_id identical to the original nested i/j loop
+    i, j = np.meshgrid(np.asarray(i_index), np.asarray(j_index), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    cell_minx = origin[0] + i * grid_size
+    cell_miny = origin[1] + j * grid_size
+
+    cells = shapely.box(cell_minx, cell_miny, cell_minx + grid_size, cell_miny + grid_size)
+    return gpd.GeoDataFrame({'cell_id': i * n_cells_y + j}, geometry=cells, crs=CRS)
+
+
+def build_lattice(minx, miny, maxx, maxy, grid_size):
+    """build every cell of the regular lattice over a bounding box in one call."""
+    n_cells_x, n_cells_y = lattice_shape(minx, miny, maxx, maxy, grid_size)
+    return build_cells((minx, miny), grid_size, n_cells_y, np.arange(n_cells_x), np.arange(n_cells_y))
+
+
+def cell_centroids(grid):
+    """x, y arrays of each (clipped) cell's centroid."""
+    centroids = grid.geometry.centroid
+    return centroids.x.to_numpy(), centroids.y.to_numpy()
+
+
+def clip_to_aoi(grid, states):
+    """clip cells to the study area, intersecting only the cells on a boundary.
+
+    returns the same rows, attributes and polygon geometry as
+    gpd.overlay(grid, states, how='intersection'). cells fully inside a state keep
+    their box unchanged and cells touching no state are dropped without any
+    polygon intersection.
+    """
+    state_geoms = states.geometry.values.copy()
+    invalid = ~shapely.is_valid(state_geoms)
+    state_geoms[invalid] = shapely.make_valid(state_geoms[invalid])
+    shapely.prepare(state_geoms)
+
+    cell_idx, state_idx = states.sindex.query(grid.geometry, predicate='intersects', sort=True)
+    cell_geoms = grid.geometry.values[cell_idx]
+    pair_states = state_geoms[state_idx]
+
+    # prepared contains test splits pairs into interior cells and boundary cells
+    boundary = ~shapely.contains(pair_states, cell_geoms)
+    clipped = np.asarray(cell_geoms, dtype=object).copy()
+    clipped[boundary] = shapely.intersection(cell_geoms[boundary], pair_states[boundary])
+
+    clipped = polygon_parts(clipped)
+    keep = np.isin(shapely.get_type_id(clipped), (3, 6))
+
+    attrs = pd.concat([
+        grid.drop(columns=grid.geometry.name).iloc[cell_idx].reset_index(drop=True),
+        states.drop(columns=states.geometry.name).iloc[state_idx].reset_index(drop=True),
+    ], axis=1)
+    clipped_grid = gpd.GeoDataFrame(attrs, geometry=clipped, crs=grid.crs)
+    return clipped_grid[keep].reset_index(drop=True)
+
+
+def calc_overlap_pct(grid, constraints):
+    """percentage of each cell covered by every constraint layer, in one spatial index pass."""
+    columns = list(constraints)
+    combined = gpd.GeoSeries(
+        pd.concat([layer.geometry for layer in constraints.values()], ignore_index=True), crs=CRS
+    )
+    layer_code = np.repeat(np.arange(len(columns)), [len(layer) for layer in constraints.values()])
+
+    # one STRtree query returns every intersecting (cell, polygon) pair across all layers
+    cell_idx, poly_idx = combined.sindex.query(grid.geometry, predicate='intersects')
+    order = np.lexsort((poly_idx, cell_idx))
+    cell_idx, poly_idx = cell_idx[order], poly_idx[order]
+
+    pair_area = shapely.area(shapely.intersection(
+        grid.geometry.values[cell_idx], combined.values[poly_idx]
+    ))
+    overlap = pd.Series(pair_area).groupby([cell_idx, layer_code[poly_idx]]).sum()
+
+    overlap_area = np.zeros((len(grid), len(columns)))
+    overlap_area[overlap.index.get_level_values(0), overlap.index.get_level_values(1)] = overlap.to_numpy()
+    overlap_pct = (overlap_area / grid.geometry.area.to_numpy()[:, None]) * 100
+    return {column: overlap_pct[:, k] for k, column in enumerate(columns)}
+
+
+def calc_overlap_pct_loop(grid, constraints):
+    """per-cell, per-layer reference implementation of calc_overlap_pct."""
+    results = {}
+
+    for column, constraint in constraints.items():
+        overlap_pct = np.zeros(len(grid))
+
+        for k, cell_geom in enumerate(grid.geometry):
+            cell_area = cell_geom.area
+
+            constraint_intersect = constraint[constraint.intersects(cell_geom)]
+            if len(constraint_intersect) > 0:
+                overlap = constraint_intersect.intersection(cell_geom).area.sum()
+                overlap_pct[k] = (overlap / cell_area) * 100
+
+        results[column] = overlap_pct
+
+    return results
+
+
+def calc_overlap_pct_raster(grid, constraints, states, origin, grid_size, n_cells_y, subcell_size):
+    """approximate overlap percentages by supersampling each cell on a fine sub-grid.
+
+    constraint polygons and the study area are rasterized at subcell_size over the
+    block of lattice cells present in grid, and each cell's coverage is the share of
+    its in-AOI sub-pixels that fall in the constraint mask. overlapping constraint
+    polygons are counted once.
+    """
+    if grid_size % subcell_size:
+        raise ValueError(f"subcell size {subcell_size} must divide grid size {grid_size}")
+    if len(grid) == 0:
+        return {column: np.zeros(0) for column in constraints}
+
+    factor = grid_size // subcell_size
+    cell_id = grid['cell_id'].to_numpy()
+    i_min, j_min = (cell_id // n_cells_y).min(), (cell_id % n_cells_y).min()
+    i, j = cell_id // n_cells_y - i_min, cell_id % n_cells_y - j_min
+    offset = (j_min * factor, i_min * factor)
+    shape = ((j.max() + 1) * factor, (i.max() + 1) * factor)
+
+    masks = {
+        column: rasterize_polygons(constraint.geometry.values, origin, subcell_size, shape, offset)
+        for column, constraint in constraints.items()
+    }
+
+    # cells split between states are scored against their own state's sub-pixels
+    point_idx, state_idx = states.sindex.query(grid.geometry.representative_point(), predicate='intersects')
+    point_idx, first = np.unique(point_idx, return_index=True)
+    cell_state = np.zeros(len(grid), dtype=int)
+    cell_state[point_idx] = state_idx[first]
+
+    inside = np.zeros(len(grid), dtype=np.int64)
+    covered = {column: np.zeros(len(grid), dtype=np.int64) for column in constraints}
+
+    for k, state_geom in enumerate(states.geometry):
+        rows = point_idx[cell_state[point_idx] == k]
+        if len(rows) == 0:
+            continue
+        state_mask = rasterize_polygons([state_geom], origin, subcell_size, shape, offset)
+        inside[rows] = block_sum(state_mask, factor)[j[rows], i[rows]]
+        for column, mask in masks.items():
+            covered[column][rows] = block_sum(state_mask & mask, factor)[j[rows], i[rows]]
+
+    # slivers too thin to hold a sub-pixel center fall back to the whole block
+    slivers = inside == 0
+    inside[slivers] = factor ** 2
+    for column, mask in masks.items():
+        covered[column][slivers] = block_sum(mask, factor)[j[slivers], i[slivers]]
+
+    return {column: (covered[column] / inside) * 100 for column in constraints}
+
+
+def build_tile(origin, grid_size, n_cells_y, i_index, j_index, states, constraints,
+               overlap_method='vector', subcell_size=100):
+    """build, clip, and measure constraint overlap for one block of lattice cells."""
+    grid = build_cells(origin, grid_size, n_cells_y, i_index, j_index)
+    grid = clip_to_aoi(grid, states)
+
+    if overlap_method == 'raster':
+        overlap_pct = calc_overlap_pct_raster(grid, constraints, states, origin, grid_size,
+                                              n_cells_y, subcell_size)
+    else:
+        overlap_pct = calc_overlap_pct(grid, constraints)
+
+    for column, pct in overlap_pct.items():
+        grid[column] = pct
+
+    return grid
+
+
+def _build_tile_task(task):
+    """process pool entry point for build_tile."""
+    return build_tile(*task)
+
+
+def split_tiles(n_cells_x, n_cells_y, n_tiles):
+    """split the lattice index ranges into a near-square arrangement of n_tiles blocks."""
+    tiles_x = max(1, min(n_cells_x, int(np.ceil(np.sqrt(n_tiles)))))
+    tiles_y = max(1, min(n_cells_y, int(np.ceil(n_tiles / tiles_x))))
+    return [
+        (i_index, j_index)
+        for i_index in np.array_split(np.arange(n_cells_x), tiles_x)
+        for j_index in np.array_split(np.arange(n_cells_y), tiles_y)
+    ]
+
+
+def subset_to_box(layer, bounds):
+    """rows of a layer intersecting a bounding box, in original order."""
+    rows = np.sort(layer.sindex.query(shapely.box(*bounds), predicate='intersects'))
+    return layer.iloc[rows]
+
+
+def create_grid(grid_size, overlap_method='vector', subcell_size=100, workers=1, tiles=None,
+                states=None, constraints=None):
+    """build the clipped grid and its constraint overlap fields.
+
+    with workers > 1 (or an explicit tile count) the lattice is split into tiles and
+    each tile's cell generation, clip and overlap run in a process pool. every worker
+    only receives the AOI and constraint polygons that intersect its tile.
+    """
+    if states is None:
+        states = load_study_area()
+    if constraints is None:
+        constraints = load_constraints()
+    print(f"loaded study area and {len(constraints)} constraint layers: "
+          f"{', '.join(layer['name'] for layer in CONSTRAINT_LAYERS)}")
+
+    minx, miny, maxx, maxy = states.total_bounds
+    origin = (minx, miny)
+    n_cells_x, n_cells_y = lattice_shape(minx, miny, maxx, maxy, grid_size)
+    print(f"grid dimensions: {n_cells_x} x {n_cells_y} ({n_cells_x * n_cells_y} cells)")
+    if overlap_method == 'raster':
+        print(f"using {subcell_size}m sub-grid supersampling for overlap")
+
+    if workers <= 1 and not tiles:
+        print("clipping cells and calculating constraint overlap")
+        grid = build_tile(origin, grid_size, n_cells_y, np.arange(n_cells_x), np.arange(n_cells_y),
+                          states, constraints, overlap_method, subcell_size)
+        print(f"cells after clipping: {len(grid)}")
+        return grid
+
+    tasks = []
+    for i_index, j_index in split_tiles(n_cells_x, n_cells_y, tiles or workers * 4):
+        tile_bounds = (minx + i_index[0] * grid_size, miny + j_index[0] * grid_size,
+                       minx + (i_index[-1] + 1) * grid_size, miny + (j_index[-1] + 1) * grid_size)
+        tile_states = subset_to_box(states, tile_bounds)
+        if len(tile_states) == 0:
+            continue
+        tile_constraints = {column: subset_to_box(layer, tile_bounds) for column, layer in constraints.items()}
+        tasks.append((origin, grid_size, n_cells_y, i_index, j_index, tile_states, tile_constraints,
+                      overlap_method, subcell_size))
+
+    print(f"processing {len(tasks)} tiles on {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tile_grids = list(pool.map(_build_tile_task, tasks))
+
+    # each cell lives in exactly one tile, so a stable sort on cell_id is deterministic
+    grid = pd.concat([tile for tile in tile_grids if len(tile)], ignore_index=True)
+    grid = grid.sort_values('cell_id', kind='stable').reset_index(drop=True)
+    grid = gpd.GeoDataFrame(grid, geometry='geometry', crs=CRS)
+    print(f"cells after clipping: {len(grid)}")
+    return grid
+
+
+def calc_line_density(grid, lines):
+    """length of line features inside each cell per unit cell area (km per km2)."""
+    cell_idx, line_idx = lines.sindex.query(grid.geometry, predicate='intersects')
+    pair_length = shapely.length(shapely.intersection(grid.geometry.values[cell_idx], lines.values[line_idx]))
+    length = np.bincount(cell_idx, weights=pair_length, minlength=len(grid))
+    return (length / 1000) / (grid.geometry.area.to_numpy() / 1e6)
+
+
+def build_adaptive_grid(coarse_size=8000, min_size=500, split_density=1.0, states=None, constraints=None):
+    """build a quadtree grid that refines coarse cells near constraint edges and dense ROW.
+
+    starts from a coarse_size lattice and splits a cell into four while its size is
+    above min_size and any constraint coverage is mixed or its ROW density is at
+    least split_density km/km2. cell_id is the id of the cell's lower-left corner on
+    the uniform min_size lattice (the grid create_grid builds at min_size), so ids
+    are unique, stable across runs and decodable with the lattice.py helpers.
+    """
+    n_levels = int(round(np.log2(coarse_size / min_size)))
+    if min_size * 2 ** n_levels != coarse_size:
+        raise ValueError(f"coarse size {coarse_size} must be min size {min_size} times a power of two")
+
+    if states is None:
+        states = load_study_area()
+    if constraints is None:
+        constraints = load_constraints()
+    row_lines = load_row_lines()
+    print(f"loaded study area, {len(constraints)} constraint layers and {len(row_lines)} ROW lines")
+
+    minx, miny, maxx, maxy = states.total_bounds
+    n_root_x, n_root_y = lattice_shape(minx, miny, maxx, maxy, coarse_size)
+    # ids use the uniform lattice's row count; the root cells reach past it, but any
+    # cell with a lower-left corner beyond it lies outside the AOI and is clipped away
+    n_fine_y = lattice_shape(minx, miny, maxx, maxy, min_size)[1]
+
+    # active cells are tracked by their lower-left index on the min_size lattice
+    root_i, root_j = np.meshgrid(np.arange(n_root_x), np.arange(n_root_y), indexing='ij')
+    root_i, root_j = root_i.ravel(), root_j.ravel()
+    fine_i, fine_j = root_i * 2 ** n_levels, root_j * 2 ** n_levels
+    quadkeys = np.array([f"{i}_{j}:" for i, j in zip(root_i, root_j)], dtype=object)
+
+    leaves = []
+    for level in range(n_levels + 1):
+        size = coarse_size >> level
+        cell_minx, cell_miny = minx + fine_i * min_size, miny + fine_j * min_size
+        cells = gpd.GeoDataFrame(
+            {'cell_id': fine_i * n_fine_y + fine_j, 'quadkey': quadkeys, 'level': level, 'cell_size': size},
+            geometry=shapely.box(cell_minx, cell_miny, cell_minx + size, cell_miny + size),
+            crs=CRS,
+        )
+        cells = clip_to_aoi(cells, states)
+        for column, pct in calc_overlap_pct(cells, constraints).items():
+            cells[column] = pct
+
+        if level == n_levels:
+            leaves.append(cells)
+            print(f"level {level} ({size}m): {len(cells)} leaf cells")
+            break
+
+        pct = cells[list(constraints)].to_numpy()
+        mixed = ((pct > MIXED_PCT_RANGE[0]) & (pct < MIXED_PCT_RANGE[1])).any(axis=1)
+        dense = calc_line_density(cells, row_lines) >= split_density
+
+        # a cell split between states is refined if any of its parts needs it
+        split = cells['cell_id'].isin(cells.loc[mixed | dense, 'cell_id'])
+        leaves.append(cells[~split])
+        parents = cells[split].drop_duplicates('cell_id')
+        print(f"level {level} ({size}m): {(~split).sum()} leaf cells, splitting {len(parents)}")
+
+        if len(parents) == 0:
+            break
+
+        # quadrant digit: 0 = SW, 1 = SE, 2 = NW, 3 = NE
+        half = 2 ** (n_levels - level - 1)
+        parent_id = parents['cell_id'].to_numpy()
+        quadrant = np.tile(np.arange(4), len(parents))
+        fine_i = np.repeat(parent_id // n_fine_y, 4) + (quadrant & 1) * half
+        fine_j = np.repeat(parent_id % n_fine_y, 4) + (quadrant >> 1) * half
+        quadkeys = np.array([key + str(q) for key, q in zip(np.repeat(parents['quadkey'].to_numpy(), 4), quadrant)],
+                            dtype=object)
+
+    grid = pd.concat([cells for cells in leaves if len(cells)], ignore_index=True)
+    grid = grid.sort_values('cell_id', kind='stable').reset_index(drop=True)
+    return gpd.GeoDataFrame(grid, geometry='geometry', crs=CRS)
+
+
+def run_settings(grid_size, overlap_method, subcell_size, dissolve, storage):
+    """settings that must match a stored grid for it to be patched incrementally."""
+    return {
+        'aoi_hash': file_hash(aoi_path),
+        'dissolve': dissolve,
+        'grid_size': grid_size,
+        'overlap_method': overlap_method,
+        'storage': storage,
+        'subcell_size': subcell_size,
+    }
+
+
+def grid_paths(grid_size):
+    """where a grid is stored in each format: GeoJSON, or the compact cell table."""
+    name = grid_name(grid_size)
+    return {'geojson': output_dir / f"{name}.geojson", 'compact': output_dir / f"{name}_cells.npz"}
+
+
+def region_key(states):
+    """first study-area attribute that names each region uniquely; clipped cells carry it."""
+    for column in states.columns.drop(states.geometry.name):
+        if states[column].is_unique:
+            return column
+    raise ValueError("study area has no attribute column that identifies each region")
+
+
+def load_compact_grid(grid_name, states):
+    """a compact grid's cells, re-clipped to the study-area region each one was clipped to."""
+    descriptor, _ = load_lattice(output_dir / f"{grid_name}_lattice.npz")
+    cells_path = output_dir / f"{grid_name}_cells.npz"
+    key = load_cells_meta(cells_path).get('region_key') or region_key(states)
+    return clip_to_regions(materialize(load_cells(cells_path), descriptor), states, key)
+
+
+def load_stored_grid(grid_size, storage, states):
+    """a grid written by an earlier run in the given storage format."""
+    if storage == 'geojson':
+        return gpd.read_file(grid_paths(grid_size)['geojson'])
+    return load_compact_grid(grid_name(grid_size), states)
+
+
+def update_grid(grid, stored_layers, constraints, grid_size, overlap_method='vector', subcell_size=100):
+    """patch a stored grid's coverage columns for constraint features changed since it was built.
+
+    each layer's per-feature fingerprint is diffed against the stored one; only cells
+    whose bounding boxes intersect an added, removed or changed feature are
+    recomputed. returns the patched grid and the new fingerprints.
+    """
+    states = load_study_area()
+    minx, miny, maxx, maxy = states.total_bounds
+    n_cells_y = lattice_shape(minx, miny, maxx, maxy, grid_size)[1]
+
+    fingerprints = {}
+    for column, layer in constraints.items():
+        fingerprints[column] = layer_fingerprint(layer)
+
+        if column not in stored_layers or column not in grid.columns:
+            rows = np.arange(len(grid))
+            grid[column] = 0.0
+            print(f"{column}: new layer, computing coverage for all {len(rows)} cells")
+        else:
+            bounds = changed_bounds(*stored_layers[column], *fingerprints[column])
+            rows = np.unique(grid.sindex.query(shapely.box(*bounds.T))[1]) if len(bounds) else []
+            print(f"{column}: {len(bounds)} changed feature extents, recomputing {len(rows)} cells")
+
+        if len(rows) == 0:
+            continue
+
+        subset = grid.iloc[rows]
+        if overlap_method == 'raster':
+            pct = calc_overlap_pct_raster(subset, {column: layer}, states, (minx, miny), grid_size,
+                                          n_cells_y, subcell_size)[column]
+        else:
+            pct = calc_overlap_pct(subset, {column: layer})[column]
+        grid.iloc[rows, grid.columns.get_loc(column)] = pct
+
+    stale = [column for column in stored_layers if column not in constraints and column in grid.columns]
+    if stale:
+        print(f"dropping unregistered constraint columns: {', '.join(stale)}")
+        grid = grid.drop(columns=stale)
+
+    return grid, fingerprints
+
+
+def benchmark_workers(grid_size, worker_counts, overlap_method='vector', subcell_size=100):
+    """report wall-clock time and speedup of the tiled build for each worker count."""
+    timings = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        create_grid(grid_size, overlap_method, subcell_size, workers=workers, tiles=max(1, workers) * 4)
+        timings.append((workers, time.perf_counter() - start))
 
-military = gpd.read_file(data_dir / "military" / "military_areas" / "military-areas.shp")
-if military.crs != CRS:
-    military = military.to_crs(CRS)
+    base = timings[0][1]
+    print(f"\n{'workers':>8} {'seconds':>10} {'speedup':>8}")
+    for workers, elapsed in timings:
+        print(f"{workers:>8} {elapsed:>10.2f} {base / elapsed:>7.1f}x")
 
-print("loaded study area, protected lands, and military areas")
 
-minx, miny, maxx, maxy = states.total_bounds
-grid_size = 2000
+def compare_overlap(grid, engines, constraints):
+    """time overlap engines against a reference engine and report their agreement.
 
-n_cells_x = int((maxx - minx) / grid_size) + 1
-n_cells_y = int((maxy - miny) / grid_size) + 1
+    engines maps a label to a function(constraints) -> {column: pct array}; the first
+    entry is the reference the others are measured against.
+    """
+    labels = list(engines)
 
-print(f"grid dimensions: {n_cells_x} x {n_cells_y}")
+    results = {}
+    for label in labels:
+        start = time.perf_counter()
+        results[label] = (engines[label](constraints), time.perf_counter() - start)
 
-grid_cells = []
-cell_ids = []
-cell_id = 0
+    ref_pct, ref_secs = results[labels[0]]
+    for label in labels[1:]:
+        pct, secs = results[label]
+        print(f"{labels[0]} {ref_secs:.2f}s, {label} {secs:.2f}s ({ref_secs / secs:.1f}x)")
+        for column in constraints:
+            error = np.abs(pct[column] - ref_pct[column])
+            if len(error) == 0:
+                error = np.zeros(1)
+            print(f"  {column} abs error (pct points): max {error.max():.2e}, mean {error.mean():.2e}, "
+                  f"p95 {np.percentile(error, 95):.2e}, within 1pt {np.mean(error <= 1) * 100:.1f}% of cells")
 
-for i in range(n_cells_x):
-    for j in range(n_cells_y):
-        cell_minx = minx + (i * grid_size)
-        cell_miny = miny + (j * grid_size)
-        cell_maxx = cell_minx + grid_size
-        cell_maxy = cell_miny + grid_size
 
-        cell = box(cell_minx, cell_miny, cell_maxx, cell_maxy)
-        grid_cells.append(cell)
-        cell_ids.append(cell_id)
-        cell_id += 1
+def _time_lattice(bounds, grid_size):
+    """build one lattice and return (cells, seconds, peak MB) for this process."""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    grid = build_lattice(*bounds, grid_size)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return len(grid), elapsed, (rss_after - rss_before) / 1024
 
-grid = gpd.GeoDataFrame({'cell_id': cell_ids}, geometry=grid_cells, crs=CRS)
-print(f"created {len(grid)} cells")
 
-grid = gpd.overlay(grid, states, how='intersection')
-print(f"cells after clipping: {len(grid)}")
+def benchmark_lattice(grid_sizes):
+    """report lattice construction time and peak memory for each resolution."""
+    bounds = tuple(load_study_area().total_bounds)
 
-# calculate protected area overlap percentage
-print("calculating protected area overlap")
-grid['protected_pct'] = 0.0
+    # fresh process per resolution so peak RSS is not carried between runs
+    ctx = mp.get_context('spawn')
+    print(f"{'grid size':>10} {'cells':>12} {'seconds':>10} {'peak MB':>10}")
+    for grid_size in grid_sizes:
+        with ctx.Pool(1) as pool:
+            n_cells, elapsed, peak_mb = pool.apply(_time_lattice, (bounds, grid_size))
+        print(f"{grid_size:>9}m {n_cells:>12,} {elapsed:>10.2f} {peak_mb:>10.1f}")
 
-protected_lands['geometry'] = protected_lands.geometry.buffer(0)
 
-for idx, cell in grid.iterrows():
-    cell_area = cell.geometry.area
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate grid cells with constraint overlap')
+    parser.add_argument('--grid-size', type=int, default=2000,
+                        help='Cell edge length in meters (default 2000)')
+    parser.add_argument('--benchmark', type=int, nargs='+', metavar='GRID_SIZE',
+                        help='Only time lattice construction at these cell sizes')
+    parser.add_argument('--overlap-method', choices=['vector', 'raster'], default='vector',
+                        help='Exact polygon intersection or sub-grid raster supersampling')
+    parser.add_argument('--subcell-size', type=int, default=100,
+                        help='Sub-grid pixel size in meters for --overlap-method raster (default 100)')
+    parser.add_argument('--compare-overlap', action='store_true',
+                        help='Report time and accuracy of the chosen overlap method against a reference')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Process pool size for tiled grid construction (default 1, serial)')
+    parser.add_argument('--tiles', type=int,
+                        help='Number of tiles to split the AOI into (default 4 per worker)')
+    parser.add_argument('--scaling', type=int, nargs='+', metavar='WORKERS',
+                        help='Only report tiled build wall-clock time for these worker counts')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Patch the stored grid for constraint features changed since the last run')
+    parser.add_argument('--raw-constraints', action='store_true',
+                        help='Use the original constraint features instead of the dissolved AOI cache')
+    parser.add_argument('--prepare-constraints', action='store_true',
+                        help='Only build the dissolved, AOI-clipped constraint cache')
+    parser.add_argument('--compact', action='store_true',
+                        help='Store the cell table without geometry (rebuilt from the lattice on demand)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Build a quadtree grid refined near constraint edges and dense ROW')
+    parser.add_argument('--coarse-size', type=int, default=8000,
+                        help='Starting cell size in meters for --adaptive (default 8000)')
+    parser.add_argument('--min-size', type=int, default=500,
+                        help='Smallest cell size in meters for --adaptive (default 500)')
+    parser.add_argument('--split-density', type=float, default=1.0,
+                        help='ROW km per km2 at or above which --adaptive splits a cell (default 1.0)')
+    args = parser.parse_args()
 
-    protected_intersect = protected_lands[protected_lands.intersects(cell.geometry)]
-    if len(protected_intersect) > 0:
-        overlap = protected_intersect.intersection(cell.geometry).area.sum()
-        grid.at[idx, 'protected_pct'] = (overlap / cell_area) * 100
+    if args.prepare_constraints:
+        load_constraints(dissolve=True)
+        print("constraint cache ready")
+    elif args.benchmark:
+        benchmark_lattice(args.benchmark)
+    elif args.scaling:
+        benchmark_workers(args.grid_size, args.scaling, args.overlap_method, args.subcell_size)
+    elif args.adaptive:
+        output_dir.mkdir(exist_ok=True)
+        grid = build_adaptive_grid(args.coarse_size, args.min_size, args.split_density,
+                                   constraints=load_constraints(not args.raw_constraints))
 
-print("protected overlap calculated")
+        print(f"\nfinal adaptive grid: {len(grid)} cells")
+        print(grid.groupby('cell_size').size().rename('cells').to_string())
+        uniform_cells = int(np.ceil(grid.geometry.area.sum() / args.min_size ** 2))
+        print(f"uniform {args.min_size}m grid over the same area: ~{uniform_cells} cells")
 
-# calculate military area overlap percentage
-print("calculating military area overlap")
-grid['military_pct'] = 0.0
+        cx, cy = cell_centroids(grid)
+        grid.insert(1, 'cx', cx)
+        grid.insert(2, 'cy', cy)
+        grid.to_file(output_dir / "grid_adaptive.geojson", driver='GeoJSON')
+        print("adaptive grid saved")
+    else:
+        output_dir.mkdir(exist_ok=True)
+        storage = 'compact' if args.compact else 'geojson'
+        paths = grid_paths(args.grid_size)
+        fingerprint_path = output_dir / f"{grid_name(args.grid_size)}_fingerprint.npz"
+        settings = run_settings(args.grid_size, args.overlap_method, args.subcell_size,
+                                not args.raw_constraints, storage)
+        states = load_study_area()
+        constraints = load_constraints(not args.raw_constraints, states)
 
-military['geometry'] = military.geometry.buffer(0)
+        grid = None
+        if args.incremental and paths[storage].exists() and fingerprint_path.exists():
+            stored_settings, stored_layers = load_fingerprint(fingerprint_path)
+            if stored_settings == settings:
+                print(f"updating {paths[storage].name} from constraint changes")
+                grid = load_stored_grid(args.grid_size, storage, states)
+                grid, fingerprints = update_grid(grid, stored_layers, constraints, args.grid_size,
+                                                 args.overlap_method, args.subcell_size)
+            else:
+                print("study area or grid settings changed, rebuilding full grid")
+        elif args.incremental:
+            print(f"no stored {storage} grid and fingerprint, building full grid")
 
-for idx, cell in grid.iterrows():
-    cell_area = cell.geometry.area
+        if grid is None:
+            grid = create_grid(args.grid_size, args.overlap_method, args.subcell_size,
+                               workers=args.workers, tiles=args.tiles, states=states, constraints=constraints)
+            fingerprints = {column: layer_fingerprint(layer) for column, layer in constraints.items()}
 
-    military_intersect = military[military.intersects(cell.geometry)]
-    if len(military_intersect) > 0:
-        overlap = military_intersect.intersection(cell.geometry).area.sum()
-        grid.at[idx, 'military_pct'] = (overlap / cell_area) * 100
+        if args.compare_overlap:
+            print("\ncomparing overlap engines")
+            if args.overlap_method == 'raster':
+                minx, miny, maxx, maxy = states.total_bounds
+                n_cells_y = lattice_shape(minx, miny, maxx, maxy, args.grid_size)[1]
+                compare_overlap(grid, {
+                    'vector': lambda layers: calc_overlap_pct(grid, layers),
+                    'raster': lambda layers: calc_overlap_pct_raster(grid, layers, states, (minx, miny), args.grid_size,
+                                                                    n_cells_y, args.subcell_size),
+                }, constraints)
+            else:
+                compare_overlap(grid, {
+                    'loop': lambda layers: calc_overlap_pct_loop(grid, layers),
+                    'bulk': lambda layers: calc_overlap_pct(grid, layers),
+                }, constraints)
 
-print("military overlap calculated")
+        print(f"\nfinal grid: {len(grid)} cells")
+        for layer in CONSTRAINT_LAYERS:
+            column = f"{layer['prefix']}_pct"
+            print(f"cells with {layer['prefix']} overlap: {len(grid[grid[column] > 0])}")
 
-print(f"\nfinal grid: {len(grid)} cells")
-print(f"cells with protected overlap: {len(grid[grid['protected_pct'] > 0])}")
-print(f"cells with military overlap: {len(grid[grid['military_pct'] > 0])}")
+        # (row, col) on the lattice makes each cell recoverable without its geometry,
+        # and later stages measure from the clipped-cell centroid (cx, cy) and index
+        # rasters by (row, col) without touching geometry
+        descriptor = make_descriptor(*states.total_bounds, args.grid_size, CRS)
+        row, col = cell_index(descriptor, grid['cell_id'].to_numpy())
+        cx, cy = cell_centroids(grid)
+        for position, (column, values) in enumerate((('row', row), ('col', col), ('cx', cx), ('cy', cy)), start=1):
+            if column in grid.columns:
+                grid[column] = values
+            else:
+                grid.insert(position, column, values)
+        save_lattice(output_dir / f"{grid_name(args.grid_size)}_lattice.npz",
+                     descriptor, validity_mask(descriptor, row, col))
 
-grid.to_file(output_dir / "grid_2km.geojson", driver='GeoJSON')
-print("grid saved")
+        if args.compact:
+            save_cells(paths['compact'], grid, meta={'region_key': region_key(states)})
+        else:
+            grid.to_file(paths['geojson'], driver='GeoJSON')
+        # a grid left in the other format would be stale, and score_grid.py could pick it up
+        for other, path in paths.items():
+            if other != storage and path.exists():
+                path.unlink()
+                print(f"removed stale {path.name}")
+        save_fingerprint(fingerprint_path, settings, fingerprints)
+        print("grid saved")
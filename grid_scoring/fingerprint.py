@@ -0,0 +1,72 @@
+# fingerprint.py
+# content hashes for grid stage inputs. source files are hashed as a whole and
+# constraint layers per feature, so a refreshed layer can be diffed against the
+# previous run to find only the features that were added, removed or changed.
+
+import hashlib
+from collections import Counter
+import numpy as np
+import shapely
+
+
+def file_hash(path):
+    """hash of a file and its same-stem sidecars (.dbf, .prj, .shx, ...)."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in sorted(path.parent.glob(f"{path.stem}.*")):
+        digest.update(part.suffix.encode())
+        digest.update(part.read_bytes())
+    return digest.hexdigest()
+
+
+def feature_hashes(layer):
+    """per-feature hash of each geometry's WKB in normalized form.
+
+    a dissolve can return an unchanged polygon with its rings starting at another
+    vertex or listed in another order; normalizing first keeps its hash stable.
+    """
+    wkb = shapely.to_wkb(shapely.normalize(layer.geometry.values))
+    return np.array(
+        [hashlib.blake2b(w or b'', digest_size=16).digest() for w in wkb], dtype='S16'
+    )
+
+
+def layer_fingerprint(layer):
+    """per-feature hashes and bounding boxes of a constraint layer."""
+    return feature_hashes(layer), shapely.bounds(layer.geometry.values)
+
+
+def changed_bounds(old_hashes, old_bounds, new_hashes, new_bounds):
+    """bounding boxes of features added, removed or changed between two fingerprints.
+
+    hashes are compared as multisets, so a duplicated or de-duplicated feature also
+    counts as a change. a changed feature contributes both its old and new box.
+    """
+    old_counts = Counter(old_hashes.tolist())
+    new_counts = Counter(new_hashes.tolist())
+    changed = [h for h in old_counts.keys() | new_counts.keys() if old_counts[h] != new_counts[h]]
+    changed = np.array(changed, dtype='S16')
+
+    return np.vstack([
+        old_bounds[np.isin(old_hashes, changed)],
+        new_bounds[np.isin(new_hashes, changed)],
+    ]).reshape(-1, 4)
+
+
+def save_fingerprint(path, meta, layers):
+    """write run settings and per-layer fingerprints to an .npz file."""
+    arrays = {f"meta_{key}": np.array(value) for key, value in meta.items()}
+    for column, (hashes, bounds) in layers.items():
+        arrays[f"{column}_hash"] = hashes
+        arrays[f"{column}_bounds"] = bounds
+    np.savez(path, **arrays)
+
+
+def load_fingerprint(path):
+    """read run settings and per-layer fingerprints written by save_fingerprint."""
+    with np.load(path) as data:
+        meta = {key[len("meta_"):]: data[key].item() for key in data.files if key.startswith("meta_")}
+        layers = {
+            key[:-len("_hash")]: (data[key], data[key[:-len("_hash")] + "_bounds"])
+            for key in data.files if key.endswith("_hash") and not key.startswith("meta_")
+        }
+    return meta, layers
@@ -0,0 +1,142 @@
+# lattice.py
+# implicit representation of the regular analysis grid. a lattice descriptor
+# (origin, cell size, n_rows, n_cols, CRS) plus each cell's (row, col) index is
+# enough to recover every cell, so tables can be stored without geometry and
+# polygons are only materialized for export.
+#
+# conventions match the corridor cost raster: origin is the lower-left corner of
+# the lattice, rows run north to south (row 0 at the top) and columns west to
+# east. cell_id = col * n_rows + (n_rows - 1 - row), the x-major order used by
+# create_grid.py.
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+
+def make_descriptor(minx, miny, maxx, maxy, cell_size, crs):
+    """lattice descriptor covering a bounding box."""
+    return {
+        'origin_x': float(minx),
+        'origin_y': float(miny),
+        'cell_size': cell_size,
+        'n_rows': int((maxy - miny) / cell_size) + 1,
+        'n_cols': int((maxx - minx) / cell_size) + 1,
+        'crs': str(crs),
+    }
+
+
+def cell_index(descriptor, cell_id):
+    """(row, col) arrays for cell ids."""
+    cell_id = np.asarray(cell_id)
+    n_rows = descriptor['n_rows']
+    return n_rows - 1 - cell_id % n_rows, cell_id // n_rows
+
+
+def cell_id_from_index(descriptor, row, col):
+    """cell ids for (row, col) arrays."""
+    n_rows = descriptor['n_rows']
+    return np.asarray(col) * n_rows + (n_rows - 1 - np.asarray(row))
+
+
+def index_from_xy(descriptor, x, y):
+    """(row, col) of the lattice cells containing points, clamped to the lattice."""
+    size = descriptor['cell_size']
+    col = np.floor((np.asarray(x) - descriptor['origin_x']) / size).astype(np.int64)
+    row = descriptor['n_rows'] - 1 - np.floor((np.asarray(y) - descriptor['origin_y']) / size).astype(np.int64)
+    return (np.clip(row, 0, descriptor['n_rows'] - 1), np.clip(col, 0, descriptor['n_cols'] - 1))
+
+
+def cell_centers(descriptor, row, col):
+    """x, y coordinates of lattice cell centers."""
+    size = descriptor['cell_size']
+    x = descriptor['origin_x'] + (np.asarray(col) + 0.5) * size
+    y = descriptor['origin_y'] + (descriptor['n_rows'] - np.asarray(row) - 0.5) * size
+    return x, y
+
+
+def cell_boxes(descriptor, row, col):
+    """unclipped lattice cell polygons for (row, col) arrays."""
+    size = descriptor['cell_size']
+    cell_minx = descriptor['origin_x'] + np.asarray(col) * size
+    cell_miny = descriptor['origin_y'] + (descriptor['n_rows'] - 1 - np.asarray(row)) * size
+    return shapely.box(cell_minx, cell_miny, cell_minx + size, cell_miny + size)
+
+
+def validity_mask(descriptor, row, col):
+    """n_rows x n_cols mask of lattice cells that are part of the AOI grid."""
+    mask = np.zeros((descriptor['n_rows'], descriptor['n_cols']), dtype=bool)
+    mask[row, col] = True
+    return mask
+
+
+def save_lattice(path, descriptor, mask):
+    """write a lattice descriptor and its AOI validity mask to an .npz file."""
+    np.savez(path, mask=mask, **{key: np.array(value) for key, value in descriptor.items()})
+
+
+def load_lattice(path):
+    """read a lattice descriptor and AOI validity mask written by save_lattice."""
+    with np.load(path) as data:
+        descriptor = {key: data[key].item() for key in data.files if key != 'mask'}
+        mask = data['mask']
+    return descriptor, mask
+
+
+def save_cells(path, table, meta=None):
+    """write a cell attribute table without geometry as columnar .npz arrays, with optional run metadata."""
+    table = pd.DataFrame(table).drop(columns='geometry', errors='ignore')
+    arrays = {'__columns__': np.array(table.columns, dtype=str)}
+    for column in table.columns:
+        values = table[column].to_numpy()
+        arrays[column] = values.astype(str) if values.dtype == object else values
+    for key, value in (meta or {}).items():
+        arrays[f"__meta_{key}__"] = np.array(value)
+    np.savez(path, **arrays)
+
+
+def load_cells(path, columns=None):
+    """read a cell table written by save_cells, optionally only some columns."""
+    with np.load(path) as data:
+        names = columns or data['__columns__'].tolist()
+        table = {}
+        for name in names:
+            values = data[name]
+            table[name] = values.astype(object) if values.dtype.kind == 'U' else values
+    return pd.DataFrame(table)
+
+
+def load_cells_meta(path):
+    """read the run metadata stored with a cell table by save_cells."""
+    with np.load(path) as data:
+        return {key[len("__meta_"):-2]: data[key].item() for key in data.files if key.startswith("__meta_")}
+
+
+def materialize(table, descriptor):
+    """GeoDataFrame of a cell table with full lattice polygons built from row/col."""
+    geometry = cell_boxes(descriptor, table['row'].to_numpy(), table['col'].to_numpy())
+    return gpd.GeoDataFrame(table, geometry=geometry, crs=descriptor['crs'])
+
+
+def polygon_parts(geoms):
+    """polygonal part of each geometry, dropping the touching lines/points of boundary intersections."""
+    geoms = np.asarray(geoms, dtype=object).copy()
+    for k in np.flatnonzero(shapely.get_type_id(geoms) == 7):
+        parts = shapely.get_parts(geoms[k])
+        polygons = parts[np.isin(shapely.get_type_id(parts), (3, 6))]
+        geoms[k] = shapely.union_all(polygons) if len(polygons) else None
+    return geoms
+
+
+def clip_to_regions(grid, regions, key):
+    """cells clipped to the region named in their key column, as they were when the grid was built.
+
+    a cell table stores no geometry, so materialize gives full lattice boxes; a cell
+    split between two regions is one row per region, each clipped to its own region.
+    """
+    region_geoms = regions.set_index(key).geometry.make_valid().loc[grid[key]].values
+    boxes = np.asarray(grid.geometry.values, dtype=object)
+    boundary = ~shapely.contains(region_geoms, boxes)
+    boxes[boundary] = shapely.intersection(boxes[boundary], region_geoms[boundary])
+    return grid.set_geometry(gpd.GeoSeries(polygon_parts(boxes), index=grid.index, crs=grid.crs))
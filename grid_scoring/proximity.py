@@ -0,0 +1,82 @@
+# proximity.py
+# batched distance engines for the proximity criteria in score_grid.py. the
+# vector engines take cell centroid coordinate arrays and return one distance per
+# cell, replacing per-cell GeoSeries.distance scans. the raster engine computes
+# distance surfaces for every pixel at once and samples them at the centroids.
+
+import json
+import numpy as np
+import shapely
+from numpy.lib.format import open_memmap
+from scipy.ndimage import distance_transform_edt
+from scipy.spatial import cKDTree
+
+from lattice import make_descriptor, index_from_xy
+from rasterize import rasterize_features
+
+
+def nearest_facility(x, y, facilities):
+    """distance from each (x, y) to the nearest facility and that facility's row position.
+
+    builds a KD-tree over the facility coordinates once and queries every point in
+    one batched call.
+    """
+    coords, owner = shapely.get_coordinates(facilities.geometry.values, return_index=True)
+    tree = cKDTree(coords)
+    dist, idx = tree.query(np.column_stack([x, y]), k=1, workers=-1)
+    return dist, owner[idx]
+
+
+def nearest_line_distance(x, y, lines, max_distance=None):
+    """distance from each (x, y) to the nearest line, NaN where none is within max_distance.
+
+    uses one bulk STRtree nearest query; capping the search radius lets points far
+    from every line return without an exact distance.
+    """
+    points = shapely.points(x, y)
+    (point_idx, _), dist = lines.sindex.nearest(points, return_distance=True, max_distance=max_distance)
+
+    # ties return several rows per point with the same distance
+    nearest = np.full(len(points), np.nan)
+    nearest[point_idx] = dist
+    return nearest
+
+
+def distance_surfaces(layers, bounds, pixel_size, out_dir, crs, margin=10000):
+    """exact Euclidean distance rasters to each layer, written as memory-mapped .npy files.
+
+    layers maps a name to a GeoSeries of points or lines. each layer is burned onto
+    a pixel_size raster over bounds (expanded by margin, so features just outside
+    the AOI still count) and an exact distance transform gives the distance from
+    every pixel center to the nearest burned pixel. surfaces are north-up
+    (distance_{name}.npy) and described by distance_lattice.json, so the corridor
+    stage and map rendering can open them with np.load(..., mmap_mode='r').
+    returns the descriptor and the open surfaces.
+    """
+    minx, miny, maxx, maxy = bounds
+    descriptor = make_descriptor(minx - margin, miny - margin, maxx + margin, maxy + margin, pixel_size, crs)
+    shape = (descriptor['n_rows'], descriptor['n_cols'])
+    origin = (descriptor['origin_x'], descriptor['origin_y'])
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / "distance_lattice.json", 'w') as f:
+        json.dump(descriptor, f, indent=2)
+
+    surfaces = {}
+    for name, geoms in layers.items():
+        mask = rasterize_features(geoms.values, origin, pixel_size, shape)
+        surface = open_memmap(out_dir / f"distance_{name}.npy", mode='w+', dtype=np.float32, shape=shape)
+        if mask.any():
+            surface[:] = np.flipud(distance_transform_edt(~mask, sampling=pixel_size))
+        else:
+            surface[:] = np.inf
+        surface.flush()
+        surfaces[name] = surface
+
+    return descriptor, surfaces
+
+
+def sample_surface(surface, descriptor, x, y):
+    """values of a north-up surface at the pixels containing each (x, y)."""
+    row, col = index_from_xy(descriptor, x, y)
+    return np.asarray(surface[row, col], dtype=np.float64)
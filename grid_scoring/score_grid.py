@@ -4,175 +4,420 @@
 # accessibility, data center proximity, ROW proximity, IREZ zones) with penalties
 # for protected/military land overlap.
 #
-# scoring: 1-9 scale where lower = more suitable
+# scoring: 1-9 scale where lower = more suitable, from the breakpoint tables in
+# scoring_tables.json (or --scoring-tables)
 # weights: renewable capacity 30%, ROW proximity 35%, data center proximity 25%, IREZ 10%
-# penalties: 0-10 based on % overlap with protected/military areas
+# penalties: 0-10 based on % overlap with each constraint layer registered in
+# create_grid.CONSTRAINT_LAYERS (protected/military areas by default)
 #
-# inputs: grid_2km.geojson, infrastructure layers, generation data
-# outputs: scored_grid.geojson with final_score field
-
+# works on any grid from create_grid.py, including variable-size adaptive cells:
+# every criterion is measured from the cell centroid (the cx/cy columns written
+# by create_grid.py) and penalties from coverage
+# percentages, so no step assumes a uniform cell size.
+#
+# usage:
+#   python score_grid.py
+#   python score_grid.py --grid grid_adaptive
+#   python score_grid.py --proximity-engine raster --pixel-size 100
+#   python score_grid.py --idw-memory-mb 512 --idw-threads 8
+#   python score_grid.py --idw-method truncated --idw-radius 50000
+#   python score_grid.py --idw-method fft --capacity-pixel-size 250
+#   python score_grid.py --scoring-tables my_tables.json
+#   python score_grid.py --recompute-features
+#   python score_grid.py --parallel-criteria
+#
+# a grid stored with create_grid.py --compact is rebuilt from its lattice
+# descriptor, with each cell clipped to its study-area region again.
+#
+# --proximity-engine raster burns ROW lines, data centers and IREZ points onto a
+# fine raster and takes every distance from exact Euclidean distance transforms,
+# so proximity cost barely depends on feature count. the surfaces are kept in
+# outputs/distance_surfaces/ as memory-mapped .npy files for reuse.
+#
+# --idw-method truncated sums plants within --idw-radius of a cell exactly and the
+# rest through a centroid expansion of --idw-bin-size bins (relative error about
+# (bin / radius) ** 2 of the far field), and adds weighted_capacity_{fuel} and
+# weighted_capacity_{status} columns from the same pass.
+#
+# --idw-method fft rasterizes Nameplate and convolves it with a 1/r kernel, giving
+# the whole capacity surface (outputs/capacity_surface/) in O(N log N) whatever
+# the plant count. plants and cell centroids are snapped to pixel centers, so a
+# plant at distance d is off by up to about pixel_size / d of its contribution:
+# far plants are nearly exact, and cells within a few pixels of a plant carry
+# most of the error. the center pixel uses the mean of 1/r over a pixel instead
+# of the exact method's 1 m floor.
+#
+# raw per-cell features (distances and weighted capacity) are written to a
+# columnar feature store, outputs/{grid}_features.npz, keyed by cell_id and a hash
+# of the grid, every input layer and the feature settings. a later run with the
+# same inputs reads the store and only re-bins and re-weights, so changing
+# breakpoints or weights never recomputes a distance. the store is also reused
+# when the ROW breakpoints change, as long as it was built with a search cap at
+# least as far as the new last edge.
+#
+# the four criteria share nothing but the cell centroids. --parallel-criteria
+# measures them at once in a process pool, with the centroid arrays in shared
+# memory, and reports each criterion's time and the speedup against the
+# critical path (the slowest criterion).
+#
+# inputs: grid_2km.geojson (or --grid), infrastructure layers, generation data
+# outputs: scored_grid.geojson (scored_{grid}.geojson for other grids) with final_score field,
+#          {grid}_features.npz
+
+import argparse
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import geopandas as gpd
 import pandas as pd
 import numpy as np
 from pathlib import Path
 
+from create_grid import CONSTRAINT_LAYERS, load_study_area, load_compact_grid
+from fingerprint import file_hash
+from lattice import load_cells, load_cells_meta, save_cells
+from capacity import idw_capacity, idw_capacity_truncated, capacity_surface
+from scoring import WEIGHTS, DEFAULT_TABLES, load_scoring_tables, apply_scoring_table, penalty_table
+from proximity import nearest_facility, nearest_line_distance, distance_surfaces, sample_surface
+
 data_dir = Path("data")
 output_dir = Path("outputs")
 
 CRS = "EPSG:5070"
 
-grid = gpd.read_file(output_dir / "grid_2km.geojson")
-print(f"loaded grid: {len(grid)} cells")
-
-transmission = gpd.read_file(data_dir / "transmission-lines" / "aoi-transmission-lines-shp" / "AOI-transmission-lines-138kv.shp").to_crs(CRS)
-roads = gpd.read_file(data_dir / "roads" / "roads-of-interest" / "roads-AOI.shp").to_crs(CRS)
-rail = gpd.read_file(data_dir / "rails" / "rails-of-interest" / "rails-AOI.shp").to_crs(CRS)
-gas_pipelines = gpd.read_file(data_dir / "pipelines" / "natural_gas" / "naturalgas-pipelines.shp").to_crs(CRS)
-hydrocarbon_pipelines = gpd.read_file(data_dir / "pipelines" / "hydrocarbon_pipelines" / "hydrocarbon-pipelines.shp").to_crs(CRS)
-data_centers = gpd.read_file(data_dir / "datacenters" / "datacenters-shp" / "datacenters-AOI.shp").to_crs(CRS)
-irez_points = gpd.read_file(data_dir / "IREZ" / "IREZ-shp" / "AOI-IREZ.shp").to_crs(CRS)
-
-wind = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "wind-plants.shp")
-solar = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "solar-plants.shp")
-hydro = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "hydro-plants.shp")
-biomass = gpd.read_file(data_dir / "power-plants" / "power-plants-shp" / "biomass-plants.shp")
-
-renewables = pd.concat([wind, solar, hydro, biomass], ignore_index=True)
-renewables = gpd.GeoDataFrame(renewables, geometry='geometry', crs=CRS)
-
-eia_proposed = renewables[renewables['PlantStatu'] == 'Proposed'].copy()
-eia_retired = renewables[renewables['PlantStatu'] == 'Retired'].copy()
-
-print(f"loaded {len(eia_proposed)} proposed renewable plants")
-print(f"loaded {len(eia_retired)} retired renewable plants")
-print(f"loaded {len(data_centers)} data centers")
-print(f"loaded {len(irez_points)} IREZ points")
-
-grid['centroid'] = grid.geometry.centroid
-
-# score data center proximity
-print("scoring: data center proximity")
-
-def score_distance_dc(dist):
-    if dist <= 50000: return 1      # <50km
-    elif dist <= 100000: return 3   # 50-100km
-    elif dist <= 200000: return 6   # 100-200km
-    else: return 9                  # >200km
-
-grid['dist_dc'] = grid['centroid'].apply(
-    lambda x: data_centers.geometry.distance(x).min()
-)
-grid['score_dc'] = grid['dist_dc'].apply(score_distance_dc)
-
-# score ROW proximity (transmission, roads, rail, pipelines)
-print("scoring: ROW proximity")
-
-row_combined = pd.concat([
-    transmission.geometry,
-    roads.geometry,
-    rail.geometry,
-    gas_pipelines.geometry,
-    hydrocarbon_pipelines.geometry
-])
-row_geom = gpd.GeoSeries(row_combined, crs=CRS)
-
-def score_distance_row(dist):
-    if dist <= 1000: return 1       # <1km
-    elif dist <= 5000: return 3     # 1-5km
-    elif dist <= 10000: return 6    # 5-10km
-    else: return 9                  # >10km
-
-grid['dist_row'] = grid['centroid'].apply(
-    lambda x: row_geom.distance(x).min()
-)
-grid['score_row'] = grid['dist_row'].apply(score_distance_row)
-
-# score renewable capacity accessibility
-# uses inverse distance weighting for proposed + retired plants
-print("scoring: renewable capacity accessibility")
-
-renewables_all = pd.concat([eia_proposed, eia_retired], ignore_index=True)
-
-def calc_weighted_capacity(centroid):
-    distances = renewables_all.geometry.distance(centroid)
-    distances = distances.replace(0, 1)
-    weights = 1 / distances
-    weighted_cap = (renewables_all['Nameplate'] * weights).sum()
-    return weighted_cap
-
-grid['weighted_capacity'] = grid['centroid'].apply(calc_weighted_capacity)
-
-def score_capacity(cap):
-    if cap >= 0.5: return 1
-    elif cap >= 0.1: return 3
-    elif cap >= 0.01: return 6
-    else: return 9
-
-grid['score_renewable'] = grid['weighted_capacity'].apply(score_capacity)
-
-# score IREZ strategic zone proximity
-print("scoring: IREZ proximity")
-
-def score_distance_irez(dist):
-    if dist <= 10000: return 1      # <10km
-    elif dist <= 25000: return 3    # 10-25km
-    elif dist <= 50000: return 6    # 25-50km
-    else: return 9                  # >50km
-
-grid['dist_irez'] = grid['centroid'].apply(
-    lambda x: irez_points.geometry.distance(x).min()
-)
-grid['score_irez'] = grid['dist_irez'].apply(score_distance_irez)
-
-# calculate penalties for protected/military overlap
-print("calculating protected area penalties")
-
-def calc_protected_penalty(pct):
-    if pct >= 75: return 10
-    elif pct >= 50: return 6
-    elif pct >= 25: return 4
-    elif pct > 0: return 2
-    else: return 0
-
-grid['penalty_protected'] = grid['protected_pct'].apply(calc_protected_penalty)
-
-print("calculating military area penalties")
-
-def calc_military_penalty(pct):
-    if pct >= 75: return 10
-    elif pct >= 50: return 6
-    elif pct >= 25: return 4
-    elif pct > 0: return 2
-    else: return 0
-
-grid['penalty_military'] = grid['military_pct'].apply(calc_military_penalty)
-
-# calculate final suitability score
-print("calculating final scores")
-
-weights = {
-    'renewable': 0.30,
-    'dc': 0.25,
-    'row': 0.35,
-    'irez': 0.10
+INPUT_LAYERS = {
+    'transmission': data_dir / "transmission-lines" / "aoi-transmission-lines-shp" / "AOI-transmission-lines-138kv.shp",
+    'roads': data_dir / "roads" / "roads-of-interest" / "roads-AOI.shp",
+    'rail': data_dir / "rails" / "rails-of-interest" / "rails-AOI.shp",
+    'gas_pipelines': data_dir / "pipelines" / "natural_gas" / "naturalgas-pipelines.shp",
+    'hydrocarbon_pipelines': data_dir / "pipelines" / "hydrocarbon_pipelines" / "hydrocarbon-pipelines.shp",
+    'data_centers': data_dir / "datacenters" / "datacenters-shp" / "datacenters-AOI.shp",
+    'irez': data_dir / "IREZ" / "IREZ-shp" / "AOI-IREZ.shp",
+    'wind': data_dir / "power-plants" / "power-plants-shp" / "wind-plants.shp",
+    'solar': data_dir / "power-plants" / "power-plants-shp" / "solar-plants.shp",
+    'hydro': data_dir / "power-plants" / "power-plants-shp" / "hydro-plants.shp",
+    'biomass': data_dir / "power-plants" / "power-plants-shp" / "biomass-plants.shp",
 }
 
-grid['final_score'] = (
-    grid['score_renewable'] * weights['renewable'] +
-    grid['score_dc'] * weights['dc'] +
-    grid['score_row'] * weights['row'] +
-    grid['score_irez'] * weights['irez'] +
-    grid['penalty_protected'] +
-    grid['penalty_military']
-)
-
-grid = grid.sort_values('final_score')
-
-print(f"scoring complete")
-print(f"best score: {grid['final_score'].min():.2f}")
-print(f"worst score: {grid['final_score'].max():.2f}")
+ROW_LAYERS = ['transmission', 'roads', 'rail', 'gas_pipelines', 'hydrocarbon_pipelines']
+FUELS = ['wind', 'solar', 'hydro', 'biomass']
+
+# settings that change feature values (memory budget and threads do not)
+FEATURE_SETTINGS = ['proximity_engine', 'pixel_size', 'idw_method', 'idw_radius', 'idw_bin_size', 'capacity_pixel_size']
+
+
+def grid_files(grid_name):
+    """files a grid is read from: its GeoJSON, or the compact lattice and cell table.
+
+    when both formats are on disk (a grid written before create_grid.py removed the
+    other format), the one written last is used.
+    """
+    grid_path = output_dir / f"{grid_name}.geojson"
+    cells_path = output_dir / f"{grid_name}_cells.npz"
+    if grid_path.exists() and not (cells_path.exists() and cells_path.stat().st_mtime > grid_path.stat().st_mtime):
+        return [grid_path]
+    return [output_dir / f"{grid_name}_lattice.npz", cells_path]
+
+
+def load_grid(grid_name):
+    """grid cells as a GeoDataFrame, clipping a compact grid's lattice boxes as the GeoJSON stores them."""
+    files = grid_files(grid_name)
+    print(f"reading grid from {', '.join(path.name for path in files)}")
+    if len(files) == 1:
+        return gpd.read_file(files[0])
+    return load_compact_grid(grid_name, load_study_area())
+
+
+def feature_hash(grid_name, args):
+    """hash of the grid, every input layer and the settings that affect feature values."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in grid_files(grid_name) + list(INPUT_LAYERS.values()):
+        digest.update(file_hash(path).encode())
+    for setting in FEATURE_SETTINGS:
+        digest.update(f"{setting}={getattr(args, setting)}".encode())
+    return digest.hexdigest()
+
+
+def load_renewables():
+    """proposed + retired renewable plants, tagged with their fuel."""
+    renewables = pd.concat([gpd.read_file(INPUT_LAYERS[fuel]).assign(fuel=fuel) for fuel in FUELS], ignore_index=True)
+    renewables = gpd.GeoDataFrame(renewables, geometry='geometry', crs=CRS)
+
+    eia_proposed = renewables[renewables['PlantStatu'] == 'Proposed'].copy()
+    eia_retired = renewables[renewables['PlantStatu'] == 'Retired'].copy()
+
+    print(f"loaded {len(eia_proposed)} proposed renewable plants")
+    print(f"loaded {len(eia_retired)} retired renewable plants")
+
+    return pd.concat([eia_proposed, eia_retired], ignore_index=True)
+
+
+def measure_proximity(name, geoms, cx, cy, bounds, args):
+    """distance from each centroid sampled from a distance-transform surface of geoms."""
+    print(f"building {args.pixel_size}m {name} distance surface")
+    surface_lattice, surfaces = distance_surfaces(
+        {name: geoms}, bounds, args.pixel_size, output_dir / "distance_surfaces", CRS,
+    )
+    return sample_surface(surfaces[name], surface_lattice, cx, cy)
+
+
+def measure_dc(cx, cy, bounds, args, row_max_distance):
+    """data center proximity."""
+    print("measuring: data center proximity")
+    data_centers = gpd.read_file(INPUT_LAYERS['data_centers']).to_crs(CRS)
+    print(f"loaded {len(data_centers)} data centers")
+    if args.proximity_engine == 'raster':
+        return {'dist_dc': measure_proximity('dc', data_centers.geometry, cx, cy, bounds, args)}
+    dist, nearest = nearest_facility(cx, cy, data_centers)
+    return {'dist_dc': dist, 'nearest_dc': nearest}
+
+
+def measure_row(cx, cy, bounds, args, row_max_distance):
+    """ROW proximity (transmission, roads, rail, pipelines)."""
+    print("measuring: ROW proximity")
+    row_geom = gpd.GeoSeries(
+        pd.concat([gpd.read_file(INPUT_LAYERS[name]).to_crs(CRS).geometry for name in ROW_LAYERS]), crs=CRS
+    )
+    if args.proximity_engine == 'raster':
+        return {'dist_row': measure_proximity('row', row_geom, cx, cy, bounds, args)}
+    dist = nearest_line_distance(cx, cy, row_geom, max_distance=row_max_distance)
+    print(f"cells beyond {row_max_distance / 1000:.0f}km of ROW: {np.isnan(dist).sum()}")
+    return {'dist_row': dist}
+
+
+def measure_renewable(cx, cy, bounds, args, row_max_distance):
+    """renewable capacity accessibility, by inverse distance weighting of proposed + retired plants."""
+    print("measuring: renewable capacity accessibility")
+    renewables_all = load_renewables()
+    plant_x = renewables_all.geometry.x.to_numpy()
+    plant_y = renewables_all.geometry.y.to_numpy()
+    nameplate = renewables_all['Nameplate'].to_numpy()
+
+    if args.idw_method == 'truncated':
+        groups = {fuel: (renewables_all['fuel'] == fuel).to_numpy() for fuel in FUELS}
+        groups['proposed'] = (renewables_all['PlantStatu'] == 'Proposed').to_numpy()
+        groups['retired'] = (renewables_all['PlantStatu'] == 'Retired').to_numpy()
+        bin_size = args.idw_bin_size or args.idw_radius / 4
+        print(f"IDW near field {args.idw_radius / 1000:.0f}km, far-field bins {bin_size / 1000:.1f}km")
+        capacity = idw_capacity_truncated(
+            cx, cy, plant_x, plant_y, nameplate, groups,
+            radius=args.idw_radius, bin_size=bin_size, memory_mb=args.idw_memory_mb,
+        )
+        columns = {'weighted_capacity': capacity['total']}
+        columns.update({f"weighted_capacity_{name}": capacity[name] for name in groups})
+        return columns
+    if args.idw_method == 'fft':
+        print(f"building {args.capacity_pixel_size}m capacity surface")
+        capacity_lattice, surface = capacity_surface(
+            plant_x, plant_y, nameplate, bounds, args.capacity_pixel_size,
+            output_dir / "capacity_surface", CRS,
+        )
+        return {'weighted_capacity': sample_surface(surface, capacity_lattice, cx, cy)}
+    return {'weighted_capacity': idw_capacity(
+        cx, cy, plant_x, plant_y, nameplate,
+        memory_mb=args.idw_memory_mb, workers=args.idw_threads,
+    )}
+
+
+def measure_irez(cx, cy, bounds, args, row_max_distance):
+    """IREZ strategic zone proximity."""
+    print("measuring: IREZ proximity")
+    irez_points = gpd.read_file(INPUT_LAYERS['irez']).to_crs(CRS)
+    print(f"loaded {len(irez_points)} IREZ points")
+    if args.proximity_engine == 'raster':
+        return {'dist_irez': measure_proximity('irez', irez_points.geometry, cx, cy, bounds, args)}
+    dist, nearest = nearest_facility(cx, cy, irez_points)
+    return {'dist_irez': dist, 'nearest_irez': nearest}
+
+
+# independent criteria; each loads its own inputs and shares only the centroids
+CRITERIA = {
+    'dc': measure_dc,
+    'row': measure_row,
+    'renewable': measure_renewable,
+    'irez': measure_irez,
+}
 
-grid = grid.drop(columns=['centroid'])
 
-grid.to_file(output_dir / "scored_grid.geojson", driver='GeoJSON')
-print("scored grid saved")
+def _measure_task(task):
+    """process pool entry point: measure one criterion from centroids in shared memory."""
+    name, shm_name, n_cells, bounds, args, row_max_distance = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    centroids = np.ndarray((2, n_cells), dtype=np.float64, buffer=shm.buf)
+    start = time.perf_counter()
+    columns = CRITERIA[name](centroids[0], centroids[1], bounds, args, row_max_distance)
+    elapsed = time.perf_counter() - start
+    del centroids
+    shm.close()
+    return name, columns, elapsed
+
+
+def compute_features(grid, args, row_max_distance):
+    """raw per-cell measurements for every criterion, measured from cell centroids.
+
+    with args.parallel_criteria the four criteria run at once in a process pool,
+    reading the centroid coordinates from one shared memory block. per-criterion
+    timings and the speedup over running them back to back are reported.
+    """
+    # centroids persisted by create_grid.py; older grids fall back to the geometry
+    if {'cx', 'cy'}.issubset(grid.columns):
+        cx = grid['cx'].to_numpy(dtype=np.float64)
+        cy = grid['cy'].to_numpy(dtype=np.float64)
+    else:
+        centroids = grid.geometry.centroid
+        cx = centroids.x.to_numpy()
+        cy = centroids.y.to_numpy()
+    bounds = grid.total_bounds
+
+    start = time.perf_counter()
+    if args.parallel_criteria:
+        shm = shared_memory.SharedMemory(create=True, size=2 * len(cx) * 8)
+        shared = np.ndarray((2, len(cx)), dtype=np.float64, buffer=shm.buf)
+        shared[0], shared[1] = cx, cy
+        tasks = [(name, shm.name, len(cx), bounds, args, row_max_distance) for name in CRITERIA]
+        try:
+            with ProcessPoolExecutor(max_workers=len(CRITERIA)) as pool:
+                results = list(pool.map(_measure_task, tasks))
+        finally:
+            del shared
+            shm.close()
+            shm.unlink()
+    else:
+        results = []
+        for name, measure in CRITERIA.items():
+            criterion_start = time.perf_counter()
+            columns = measure(cx, cy, bounds, args, row_max_distance)
+            results.append((name, columns, time.perf_counter() - criterion_start))
+    elapsed = time.perf_counter() - start
+
+    features = pd.DataFrame(index=grid.index)
+    for name, columns, seconds in results:
+        for column, values in columns.items():
+            features[column] = values
+        print(f"  {name}: {seconds:.2f}s")
+    total = sum(seconds for _, _, seconds in results)
+    critical = max(seconds for _, _, seconds in results)
+    print(f"criteria: {total:.2f}s back to back, {critical:.2f}s critical path, {elapsed:.2f}s wall")
+    if args.parallel_criteria:
+        print(f"speedup: {total / elapsed:.2f}x (critical-path bound {total / critical:.2f}x)")
+
+    return features
+
+
+def load_features(path, grid, input_hash, row_max_distance):
+    """stored features if they were built from the same inputs for the same cells, else None."""
+    if not path.exists():
+        return None
+    meta = load_cells_meta(path)
+    if meta.get('input_hash') != input_hash or meta.get('row_max_distance', 0) < row_max_distance:
+        return None
+    features = load_cells(path)
+    if len(features) != len(grid):
+        return None
+    if 'cell_id' in grid.columns and not np.array_equal(features['cell_id'].to_numpy(), grid['cell_id'].to_numpy()):
+        return None
+    features.index = grid.index
+    return features.drop(columns='cell_id', errors='ignore')
+
+
+def save_features(path, grid, features, input_hash, row_max_distance):
+    """write features keyed by cell_id with the input hash they were built from."""
+    table = features.copy()
+    if 'cell_id' in grid.columns:
+        table.insert(0, 'cell_id', grid['cell_id'].to_numpy())
+    save_cells(path, table, meta={'input_hash': input_hash, 'row_max_distance': row_max_distance})
+
+
+def score_features(grid, tables):
+    """criterion scores, constraint penalties and weighted final score from raw features."""
+    grid['score_dc'] = apply_scoring_table(grid['dist_dc'], tables['dc'])
+    grid['score_row'] = apply_scoring_table(grid['dist_row'], tables['row'])
+    grid['score_renewable'] = apply_scoring_table(grid['weighted_capacity'], tables['renewable'])
+    grid['score_irez'] = apply_scoring_table(grid['dist_irez'], tables['irez'])
+
+    # calculate penalties for every constraint layer present on the grid
+    penalty_columns = []
+    for layer in CONSTRAINT_LAYERS:
+        pct_column = f"{layer['prefix']}_pct"
+        if pct_column not in grid.columns:
+            continue
+        print(f"calculating {layer['prefix']} area penalties")
+        grid[f"penalty_{layer['prefix']}"] = apply_scoring_table(grid[pct_column], penalty_table(tables, layer['prefix']))
+        penalty_columns.append(f"penalty_{layer['prefix']}")
+
+    # calculate final suitability score
+    print("calculating final scores")
+    grid['final_score'] = (
+        grid['score_renewable'] * WEIGHTS['renewable'] +
+        grid['score_dc'] * WEIGHTS['dc'] +
+        grid['score_row'] * WEIGHTS['row'] +
+        grid['score_irez'] * WEIGHTS['irez']
+    )
+    for column in penalty_columns:
+        grid['final_score'] = grid['final_score'] + grid[column]
+
+    return grid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score grid cells for transmission corridor suitability')
+    parser.add_argument('--grid', default='grid_2km',
+                        help='Grid layer in outputs/ to score, e.g. grid_500m or grid_adaptive (default grid_2km)')
+    parser.add_argument('--proximity-engine', choices=['vector', 'raster'], default='vector',
+                        help='Nearest-feature queries or distance-transform surfaces for proximity criteria')
+    parser.add_argument('--pixel-size', type=int, default=100,
+                        help='Distance surface resolution in meters for --proximity-engine raster (default 100)')
+    parser.add_argument('--idw-method', choices=['exact', 'truncated', 'fft'], default='exact',
+                        help='All-pairs IDW, radius-limited IDW with per-fuel/status columns, '
+                             'or FFT convolution surface (default exact)')
+    parser.add_argument('--idw-radius', type=float, default=50000,
+                        help='Exact near-field radius in meters for --idw-method truncated (default 50000)')
+    parser.add_argument('--idw-bin-size', type=float, default=None,
+                        help='Far-field bin size in meters for --idw-method truncated (default radius / 4)')
+    parser.add_argument('--capacity-pixel-size', type=int, default=250,
+                        help='Capacity surface resolution in meters for --idw-method fft (default 250)')
+    parser.add_argument('--idw-memory-mb', type=float, default=256,
+                        help='Memory budget for each block of the IDW distance matrix (default 256)')
+    parser.add_argument('--idw-threads', type=int, default=1,
+                        help='Threads evaluating IDW blocks in parallel (default 1)')
+    parser.add_argument('--scoring-tables', type=Path, default=DEFAULT_TABLES,
+                        help='JSON breakpoint tables for each criterion (default grid_scoring/scoring_tables.json)')
+    parser.add_argument('--parallel-criteria', action='store_true',
+                        help='Measure the DC, ROW, renewable and IREZ criteria at once in a process pool')
+    parser.add_argument('--recompute-features', action='store_true',
+                        help='Recompute distances and capacity even if the feature store is current')
+    args = parser.parse_args()
+
+    tables = load_scoring_tables(args.scoring_tables)
+
+    grid = load_grid(args.grid)
+    print(f"loaded grid: {len(grid)} cells")
+    if 'cell_size' in grid.columns:
+        print(f"variable cell sizes: {', '.join(f'{size}m' for size in sorted(grid['cell_size'].unique()))}")
+
+    # cells with no ROW within the last breakpoint get the table's top score whatever
+    # the exact distance, so the nearest-line search stops there and leaves dist_row
+    # empty (scored as missing). distance surfaces are uncapped.
+    row_max_distance = tables['row']['edges'][-1] if args.proximity_engine == 'vector' else np.inf
+
+    features_path = output_dir / f"{args.grid}_features.npz"
+    input_hash = feature_hash(args.grid, args)
+    features = None if args.recompute_features else load_features(features_path, grid, input_hash, row_max_distance)
+    if features is None:
+        features = compute_features(grid, args, row_max_distance)
+        save_features(features_path, grid, features, input_hash, row_max_distance)
+        print(f"features saved to {features_path.name}")
+    else:
+        print(f"reusing features from {features_path.name}")
+
+    grid = score_features(pd.concat([grid, features], axis=1), tables)
+    grid = grid.sort_values('final_score')
+
+    print(f"scoring complete")
+    print(f"best score: {grid['final_score'].min():.2f}")
+    print(f"worst score: {grid['final_score'].max():.2f}")
+
+    scored_name = "scored_grid" if args.grid == "grid_2km" else f"scored_{args.grid}"
+    grid.to_file(output_dir / f"{scored_name}.geojson", driver='GeoJSON')
+    print("scored grid saved")
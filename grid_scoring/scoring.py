@@ -0,0 +1,77 @@
+# scoring.py
+# declarative breakpoint scoring for score_grid.py. each criterion is a table of
+# ascending edges and one score per bin, evaluated over a whole column with
+# np.searchsorted instead of an if/elif chain per cell.
+#
+# table fields:
+#   edges     ascending breakpoints
+#   scores    len(edges) + 1 scores, one per bin from below the first edge up
+#   edge_bin  "lower" if a value equal to an edge scores in the bin below it
+#             (a <= breakpoint), "upper" if it scores in the bin above (>=);
+#             one string for every edge or a list with one entry per edge
+#   missing   score for NaN values (default: the last bin)
+#
+# tables are keyed by criterion (dc, row, renewable, irez). "penalty" scores every
+# constraint layer's {prefix}_pct; a "penalty_{prefix}" table overrides it for
+# one layer.
+
+import json
+from pathlib import Path
+import numpy as np
+
+DEFAULT_TABLES = Path(__file__).parent / "scoring_tables.json"
+
+# MCDA weights of each criterion's score_{criterion} column
+WEIGHTS = {
+    'renewable': 0.30,
+    'dc': 0.25,
+    'row': 0.35,
+    'irez': 0.10
+}
+
+
+def check_table(name, table):
+    """validate one scoring table."""
+    edges = np.asarray(table['edges'], dtype=float)
+    if len(edges) == 0:
+        raise ValueError(f"scoring table {name}: needs at least one edge")
+    if np.any(np.diff(edges) <= 0):
+        raise ValueError(f"scoring table {name}: edges must be strictly increasing")
+    if len(table['scores']) != len(edges) + 1:
+        raise ValueError(f"scoring table {name}: needs {len(edges) + 1} scores for {len(edges)} edges")
+    edge_bin = table.get('edge_bin', 'lower')
+    if isinstance(edge_bin, str):
+        edge_bin = [edge_bin] * len(edges)
+    if len(edge_bin) != len(edges) or any(side not in ('lower', 'upper') for side in edge_bin):
+        raise ValueError(f"scoring table {name}: edge_bin must be 'lower'/'upper' for each edge")
+
+
+def load_scoring_tables(path=DEFAULT_TABLES):
+    """read and validate scoring tables from a JSON file."""
+    with open(path) as f:
+        tables = json.load(f)
+    for name, table in tables.items():
+        check_table(name, table)
+    return tables
+
+
+def apply_scoring_table(values, table):
+    """score an array of values with a breakpoint table."""
+    values = np.asarray(values, dtype=float)
+    edges = np.asarray(table['edges'], dtype=float)
+    scores = np.asarray(table['scores'])
+    edge_bin = table.get('edge_bin', 'lower')
+    upper = np.asarray([edge_bin] * len(edges) if isinstance(edge_bin, str) else edge_bin) == 'upper'
+
+    # edges strictly below the value, then step over an equal edge that belongs to the upper bin
+    below = np.searchsorted(edges, values, side='left')
+    on_edge = below < np.searchsorted(edges, values, side='right')
+    bins = below + (on_edge & upper[np.minimum(below, len(edges) - 1)])
+
+    missing = table.get('missing', scores[-1])
+    return np.where(np.isnan(values), missing, scores[bins])
+
+
+def penalty_table(tables, prefix):
+    """scoring table for one constraint layer's penalty."""
+    return tables.get(f"penalty_{prefix}", tables['penalty'])
@@ -0,0 +1,173 @@
+# sensitivity.py
+# Monte Carlo sensitivity of the suitability map to the MCDA weights. keeps the
+# per-criterion score matrix from score_grid.py and re-weights it for thousands
+# of weight vectors at once, without recomputing any distances.
+#
+# weights are sampled from a Dirichlet centered on the score_grid.py weights
+# (--concentration sets how tightly) or uniformly within per-criterion ranges
+# (--range row=0.25:0.45). a sampled weight is used as drawn; the unlisted
+# criteria share the rest of the total of 1 in proportion to their score_grid.py
+# weights. penalties are added unweighted, as in score_grid.py.
+#
+# criterion scores are discrete, so cells collapse to a few hundred distinct score
+# profiles. each batch of scenarios is one (profiles x 4) @ (4 x scenarios) matrix
+# multiply, and ranks are counted over profiles weighted by how many cells share
+# them. rank is the fraction of cells scoring strictly better (0 = best).
+#
+# outputs per cell:
+#   top_decile_prob  share of scenarios where the cell ranks in the best 10%
+#   rank_mean        mean rank across scenarios
+#   rank_std         standard deviation of rank (low = stable)
+#   rank_base        rank under the score_grid.py weights
+#
+# usage:
+#   python sensitivity.py
+#   python sensitivity.py --scenarios 10000 --concentration 20
+#   python sensitivity.py --range row=0.25:0.45 --range dc=0.15:0.35
+#
+# inputs: scored_grid.geojson (or scored_{grid}.geojson with --grid)
+# outputs: sensitivity_grid.geojson (sensitivity_{grid}.geojson for other grids)
+
+import argparse
+import time
+import geopandas as gpd
+import numpy as np
+from pathlib import Path
+
+from scoring import WEIGHTS
+
+output_dir = Path("outputs")
+
+CRITERIA = list(WEIGHTS)
+
+
+def score_profiles(grid):
+    """distinct (criterion scores, total penalty) rows, each cell's profile and profile cell counts."""
+    scores = grid[[f"score_{name}" for name in CRITERIA]].to_numpy(dtype=float)
+    penalty_columns = [column for column in grid.columns if column.startswith("penalty_")]
+    penalty = grid[penalty_columns].to_numpy(dtype=float).sum(axis=1)
+
+    profiles, inverse, counts = np.unique(
+        np.column_stack([scores, penalty]), axis=0, return_inverse=True, return_counts=True
+    )
+    return profiles[:, :-1], profiles[:, -1], inverse.ravel(), counts
+
+
+def sample_weights(n, rng, concentration=None, ranges=None):
+    """n weight vectors over CRITERIA, from a Dirichlet around WEIGHTS or uniform within ranges.
+
+    with ranges, each listed criterion is drawn uniformly within its range and kept
+    as drawn, and the unlisted criteria are scaled from WEIGHTS to fill the rest
+    of the total of 1.
+    """
+    base = np.array([WEIGHTS[name] for name in CRITERIA])
+    if ranges:
+        listed = np.array([name in ranges for name in CRITERIA])
+        if listed.all():
+            raise ValueError("every criterion has a range; leave at least one unlisted to fill the total of 1")
+        low = np.array([ranges[name][0] for name in CRITERIA if name in ranges])
+        high = np.array([ranges[name][1] for name in CRITERIA if name in ranges])
+        if high.sum() > 1:
+            raise ValueError(f"range upper bounds sum to {high.sum():g}, above the total weight of 1")
+
+        weights = np.empty((n, len(CRITERIA)))
+        weights[:, listed] = rng.uniform(low, high, size=(n, listed.sum()))
+        rest = 1 - weights[:, listed].sum(axis=1, keepdims=True)
+        weights[:, ~listed] = rest * base[~listed] / base[~listed].sum()
+        return weights
+    return rng.dirichlet(concentration * base, size=n)
+
+
+def profile_ranks(final, counts, n_cells):
+    """rank of each profile in each scenario: share of cells with a strictly better score."""
+    ranks = np.empty(final.shape)
+    for s in range(final.shape[1]):
+        order = np.argsort(final[:, s], kind='stable')
+        ordered = final[order, s]
+        cells_before = np.concatenate([[0], np.cumsum(counts[order])])
+        ranks[:, s] = cells_before[np.searchsorted(ordered, final[:, s], side='left')] / n_cells
+    return ranks
+
+
+def run_sensitivity(grid, weights, batch_size=1000):
+    """top-decile probability and rank statistics per cell over weight scenarios."""
+    scores, penalty, inverse, counts = score_profiles(grid)
+    n_cells = len(grid)
+    top_cut = 0.1
+
+    base = np.array([[WEIGHTS[name] for name in CRITERIA]])
+    rank_base = profile_ranks(scores @ base.T + penalty[:, None], counts, n_cells)[:, 0]
+
+    top_count = np.zeros(len(counts))
+    rank_sum = np.zeros(len(counts))
+    rank_sq = np.zeros(len(counts))
+    for start in range(0, len(weights), batch_size):
+        batch = weights[start:start + batch_size]
+        final = scores @ batch.T + penalty[:, None]
+        ranks = profile_ranks(final, counts, n_cells)
+        top_count += (ranks < top_cut).sum(axis=1)
+        rank_sum += ranks.sum(axis=1)
+        rank_sq += (ranks ** 2).sum(axis=1)
+
+    n = len(weights)
+    rank_mean = rank_sum / n
+    rank_std = np.sqrt(np.maximum(rank_sq / n - rank_mean ** 2, 0))
+
+    return {
+        'top_decile_prob': (top_count / n)[inverse],
+        'rank_mean': rank_mean[inverse],
+        'rank_std': rank_std[inverse],
+        'rank_base': rank_base[inverse],
+    }, len(counts)
+
+
+def parse_range(text):
+    """criterion=low:high -> (criterion, (low, high))."""
+    name, bounds = text.split('=')
+    low, high = (float(value) for value in bounds.split(':'))
+    if name not in WEIGHTS:
+        raise argparse.ArgumentTypeError(f"unknown criterion {name}, expected one of {', '.join(CRITERIA)}")
+    if not 0 <= low <= high <= 1:
+        raise argparse.ArgumentTypeError(f"range for {name} must satisfy 0 <= low <= high <= 1")
+    return name, (low, high)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo sensitivity of suitability ranks to MCDA weights')
+    parser.add_argument('--grid', default='grid_2km',
+                        help='Grid whose scored output to analyze (default grid_2km)')
+    parser.add_argument('--scenarios', type=int, default=10000,
+                        help='Number of weight scenarios (default 10000)')
+    parser.add_argument('--concentration', type=float, default=50,
+                        help='Dirichlet concentration around the score_grid.py weights; lower = wider (default 50)')
+    parser.add_argument('--range', type=parse_range, action='append', dest='ranges',
+                        help='Sample a criterion uniformly, e.g. row=0.25:0.45; unlisted criteria are '
+                             'scaled in proportion to their weights to fill the rest of 1')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default 0)')
+    args = parser.parse_args()
+
+    scored_name = "scored_grid" if args.grid == "grid_2km" else f"scored_{args.grid}"
+    grid = gpd.read_file(output_dir / f"{scored_name}.geojson")
+    print(f"loaded {len(grid)} scored cells")
+
+    rng = np.random.default_rng(args.seed)
+    try:
+        weights = sample_weights(args.scenarios, rng, args.concentration, dict(args.ranges) if args.ranges else None)
+    except ValueError as error:
+        parser.error(str(error))
+
+    start = time.perf_counter()
+    results, n_profiles = run_sensitivity(grid, weights)
+    print(f"{args.scenarios} scenarios over {n_profiles} score profiles in {time.perf_counter() - start:.2f}s")
+
+    for column, values in results.items():
+        grid[column] = values
+
+    print(f"cells always in top decile: {(grid['top_decile_prob'] == 1).sum()}")
+    print(f"cells in top decile in some scenarios: {((grid['top_decile_prob'] > 0) & (grid['top_decile_prob'] < 1)).sum()}")
+    print(f"mean rank std: {grid['rank_std'].mean():.4f}")
+
+    sensitivity_name = "sensitivity_grid" if args.grid == "grid_2km" else f"sensitivity_{args.grid}"
+    grid.to_file(output_dir / f"{sensitivity_name}.geojson", driver='GeoJSON')
+    print("sensitivity grid saved")